@@ -2,85 +2,95 @@
 """Crop a white rectangular badge from an image if present."""
 
 import argparse
+import json
+import os
 from pathlib import Path
+import sys
 import cv2
-import numpy as np
-
-
-def find_badge(image: np.ndarray):
-    """Return bounding box (x, y, w, h) of the most likely badge or ``None``."""
-
-    # Resize large images for faster processing while keeping a scale factor
-    scale = 1000.0 / image.shape[1]
-    if scale < 1.0:
-        small = cv2.resize(image, (0, 0), fx=scale, fy=scale)
-        factor = 1.0 / scale
-    else:
-        small = image
-        factor = 1.0
-
-    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-
-    # Automatically choose a threshold value with Otsu's method
-    _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
-
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    img_area = small.shape[0] * small.shape[1]
-
-    best_rect = None
-    best_score = 0.0
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < img_area * 0.005:
-            continue
-        x, y, w, h = cv2.boundingRect(cnt)
-        aspect = w / float(h)
-        if not (0.4 <= aspect <= 2.5):
-            continue
-
-        rect_area = float(w * h)
-        rectangularity = area / rect_area
-        whiteness = np.mean(gray[y : y + h, x : x + w]) / 255.0
-
-        score = (whiteness ** 3) * (rectangularity ** 2) / ((area / img_area) ** 0.5)
-
-        if score > best_score:
-            best_score = score
-            best_rect = (
-                int(x * factor),
-                int(y * factor),
-                int(w * factor),
-                int(h * factor),
-            )
-    return best_rect
-
-
-def crop_badge(image: np.ndarray):
-    rect = find_badge(image)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'shared'))
+from badgedetect import crop_badge, find_badge
+from imageload import IMAGE_SUFFIXES, load_image
+from workers import worker_pool
+
+
+def crop_file(path: Path, output_dir: Path):
+    """Write the badge crop of ``path`` into ``output_dir``.
+
+    Returns the badge rectangle as a list, or ``None`` if no badge was found
+    or the image could not be processed.  Never raises, so one bad file
+    cannot abort a folder run.
+    """
+    try:
+        return _crop_file(path, output_dir)
+    except Exception as e:
+        print(f"{path.name}: failed ({e})")
+        return None
+
+
+def _crop_file(path: Path, output_dir: Path):
+    try:
+        img = load_image(path, bgr=True)
+    except OSError:
+        print(f"Could not read {path}")
+        return None
+    rect = find_badge(img)
     if rect is None:
+        print(f"{path.name}: no badge detected")
         return None
     x, y, w, h = rect
-    return image[y : y + h, x : x + w]
+    dest = output_dir / f"{path.stem}-badge.jpeg"
+    if not cv2.imwrite(str(dest), img[y : y + h, x : x + w]):
+        raise OSError(f"could not write {dest}")
+    print(f"{path.name}: saved badge crop to {dest}")
+    return [x, y, w, h]
+
+
+def crop_folder(input_dir: Path, output_dir: Path, workers: int | None = None):
+    """Crop the badge of every image in ``input_dir`` on ``workers`` processes.
+
+    Crops are written to ``output_dir`` together with ``index.json``, which
+    maps each image name to its badge rectangle ``[x, y, w, h]`` or ``null``.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = sorted(p for p in input_dir.iterdir()
+                   if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+    with worker_pool(workers) as pool:
+        rects = list(pool.map(crop_file, paths, [output_dir] * len(paths)))
+    index = {path.name: rect for path, rect in zip(paths, rects)}
+    with open(output_dir / "index.json", "w") as f:
+        json.dump(index, f, indent=2)
+    found = sum(rect is not None for rect in rects)
+    print(f"Found badges in {found} of {len(paths)} images")
+    return index
 
 
 def main():
     parser = argparse.ArgumentParser(description="Crop white badge from an image if found")
-    parser.add_argument("image", help="Input image path")
-    parser.add_argument("-o", "--output", default="badge.jpeg", help="Output file path")
+    parser.add_argument("image", help="Input image path, or a folder to crop every image in it")
+    parser.add_argument("-o", "--output",
+                        help="Output file path (default badge.jpeg), or output folder "
+                             "for a folder of images (default badges)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="Processes to use for a folder of images")
     args = parser.parse_args()
 
-    img = cv2.imread(args.image)
-    if img is None:
+    if Path(args.image).is_dir():
+        crop_folder(Path(args.image), Path(args.output or "badges"), args.workers)
+        return
+
+    try:
+        img = load_image(args.image, bgr=True)
+    except OSError:
         parser.error(f"Could not read {args.image}")
 
     badge = crop_badge(img)
     if badge is None:
         print("No badge detected")
         return
-    cv2.imwrite(args.output, badge)
-    print(f"Saved badge crop to {args.output}")
+    output = args.output or "badge.jpeg"
+    cv2.imwrite(output, badge)
+    print(f"Saved badge crop to {output}")
 
 
 if __name__ == "__main__":
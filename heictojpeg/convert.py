@@ -3,16 +3,15 @@
 
 import argparse
 from pathlib import Path
-from PIL import Image, ImageOps
-import pillow_heif
+import sys
 
-pillow_heif.register_heif_opener()
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'shared'))
+from imageload import HEIF_SUFFIXES, load_image
 
 def convert_image(path: Path):
     """Convert a single HEIC image to JPEG and remove the original."""
     try:
-        img = Image.open(path)
-        img = ImageOps.exif_transpose(img)
+        img = load_image(path)
         dest = path.with_suffix('.jpeg')
         img.convert('RGB').save(dest, format='JPEG')
         path.unlink()
@@ -23,7 +22,7 @@ def convert_image(path: Path):
 
 def convert_folder(folder: Path):
     for file in folder.iterdir():
-        if file.is_file() and file.suffix.lower() in {'.heic', '.heif'}:
+        if file.is_file() and file.suffix.lower() in HEIF_SUFFIXES:
             convert_image(file)
 
 
@@ -3,42 +3,97 @@ import mediapipe as mp
 import numpy as np
 from pathlib import Path
 import argparse
+from functools import partial
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'shared'))
+from imageload import load_image
+from mpmodels import get_models
+from workers import worker_pool
 
-mp_face_detection = mp.solutions.face_detection
 mp_pose = mp.solutions.pose
 
+# Long side of the copy the face is searched on.
+PREVIEW_SIZE = 1024
+# Lossless quarter turns of the preview for each coarse angle (degrees
+# counter-clockwise, as in cv2.getRotationMatrix2D).
+QUARTER_TURNS = {
+    0: None,
+    90: cv2.ROTATE_90_COUNTERCLOCKWISE,
+    -90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+}
+
+def rotation_matrix(shape, angle):
+    """Return the affine matrix and output ``(width, height)`` that rotate an
+    image of ``shape`` counter-clockwise by ``angle`` degrees.
+
+    Within 45 degrees of a quarter turn the output has the width and height
+    swapped, so the photo is not cut off.
+    """
+    h, w = shape[:2]
+    out_w, out_h = (h, w) if round(angle / 90) % 2 else (w, h)
+    # pixel centres, so that quarter turns land exactly on the pixel grid
+    M = cv2.getRotationMatrix2D(((w - 1) / 2, (h - 1) / 2), angle, 1.0)
+    M[0, 2] += (out_w - w) / 2
+    M[1, 2] += (out_h - h) / 2
+    return M, (out_w, out_h)
+
+
 def rotate_image(img, angle):
-    h, w = img.shape[:2]
-    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
-    return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-
-
-def align_face(image):
-    with mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.5) as face_detection:
-        for base_angle in [0, 90, -90, 180]:
-            rotated = rotate_image(image, base_angle)
-            results = face_detection.process(cv2.cvtColor(rotated, cv2.COLOR_BGR2RGB))
-            if results.detections:
-                detection = results.detections[0]
-                h, w = rotated.shape[:2]
-                keypoints = detection.location_data.relative_keypoints
-                right_eye = keypoints[0]
-                left_eye = keypoints[1]
-                eye_dx = (left_eye.x - right_eye.x) * w
-                eye_dy = (left_eye.y - right_eye.y) * h
-                roll = np.degrees(np.arctan2(eye_dy, eye_dx))
-                total_angle = base_angle + roll
-                return rotate_image(image, total_angle), total_angle
-    return image, 0
-
-def crop_portrait(image):
+    M, size = rotation_matrix(img.shape, angle)
+    return cv2.warpAffine(img, M, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def preview_image(image, max_size=PREVIEW_SIZE):
+    h, w = image.shape[:2]
+    if max(h, w) <= max_size:
+        return image
+    scale = max_size / max(h, w)
+    return cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+
+def find_face_angle(image, models=None):
+    """Return the counter-clockwise angle that makes the face upright, or None.
+
+    The coarse orientation is searched with quarter turns of a small copy.
+    The loader has already applied the EXIF orientation, so the photo as
+    loaded is tried first, then the turns that make a landscape frame
+    portrait.
+    """
+    face_detection = (models or get_models()).face_detection
+    rgb = cv2.cvtColor(preview_image(image), cv2.COLOR_BGR2RGB)
+    h, w = rgb.shape[:2]
+    angles = [0, 90, -90, 180] if w > h else [0, 180, 90, -90]
+    for base_angle in angles:
+        code = QUARTER_TURNS[base_angle]
+        rotated = rgb if code is None else cv2.rotate(rgb, code)
+        results = face_detection.process(rotated)
+        if results.detections:
+            detection = results.detections[0]
+            h, w = rotated.shape[:2]
+            keypoints = detection.location_data.relative_keypoints
+            right_eye = keypoints[0]
+            left_eye = keypoints[1]
+            eye_dx = (left_eye.x - right_eye.x) * w
+            eye_dy = (left_eye.y - right_eye.y) * h
+            roll = np.degrees(np.arctan2(eye_dy, eye_dx))
+            return base_angle + roll
+    return None
+
+
+def portrait_rect(image, models=None, size=None):
+    """Return ``(left, top, width, height)`` of the 2:3 portrait crop, or None.
+
+    The pose is found on ``image``; the rectangle is given for the same
+    framing at ``size`` (width, height), by default the size of ``image``.
+    """
     rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    with mp_pose.Pose(static_image_mode=True) as pose:
-        result = pose.process(rgb)
+    result = (models or get_models()).pose.process(rgb)
     if not result.pose_landmarks:
         return None
     landmarks = result.pose_landmarks.landmark
-    h, w = image.shape[:2]
+    w, h = size or (image.shape[1], image.shape[0])
     nose = landmarks[mp_pose.PoseLandmark.NOSE]
     left_hip = landmarks[mp_pose.PoseLandmark.LEFT_HIP]
     right_hip = landmarks[mp_pose.PoseLandmark.RIGHT_HIP]
@@ -50,36 +105,79 @@ def crop_portrait(image):
     top = max(0, int(nose_y - H / 3))
     if top + H > h:
         H = h - top
-    W = int(H * 2 / 3)
+    W = min(w, int(H * 2 / 3))
     center_x = int(nose_x)
     left = center_x - W // 2
     left = max(0, min(w - W, left))
-    bottom = top + H
-    right = left + W
-    crop = image[top:bottom, left:right]
-    return crop
+    return left, top, W, H
+
+def format_image(image, models=None, height=None):
+    """Return ``image`` rotated upright and cropped to a 2:3 portrait.
+
+    The face and pose are found on a small preview; the full-resolution
+    photo is then resampled once, straight from the original pixels into
+    the crop, scaled to ``height`` pixels if given.  Without a pose the
+    whole rotated photo is returned.
+    """
+    models = models or get_models()
+    preview = preview_image(image)
+    angle = find_face_angle(preview, models) or 0
+    M, (w, h) = rotation_matrix(image.shape, angle)
+    rect = portrait_rect(rotate_image(preview, angle), models, (w, h))
+    left, top, W, H = rect or (0, 0, w, h)
+    out_h = height or H
+    out_w = max(1, round(W * out_h / H))
+    sx, sy = out_w / W, out_h / H
+    # rotated pixel (x, y) -> output pixel, on pixel centres
+    crop = np.array([[sx, 0, (0.5 - left) * sx - 0.5],
+                     [0, sy, (0.5 - top) * sy - 0.5]])
+    M = crop @ np.vstack([M, [0, 0, 1]])
+    return cv2.warpAffine(image, M, (out_w, out_h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def format_file(img_path, output_dir, height=None):
+    """Format one photo into ``output_dir`` and return a progress message."""
+    try:
+        image = load_image(img_path, bgr=True)
+    except OSError:
+        return f"Skipped {img_path}"
+    output_path = output_dir / img_path.name
+    cv2.imwrite(str(output_path), format_image(image, height=height))
+    return f"Processed {img_path} -> {output_path}"
+
+
+def run_tasks(task, paths, workers=1):
+    """Run ``task`` on every path and print its messages in order.
+
+    With ``workers`` above one the paths are spread over that many processes.
+    Each process loads the MediaPipe models once (see ``get_models``) and
+    reuses them for all of its photos.
+    """
+    if workers <= 1:
+        messages = map(task, paths)
+        for i, message in enumerate(messages, 1):
+            print(f"[{i}/{len(paths)}] {message}")
+        return
+    with worker_pool(workers) as pool:
+        for i, message in enumerate(pool.map(task, paths), 1):
+            print(f"[{i}/{len(paths)}] {message}")
+
+
+def image_paths(input_dir):
+    return [p for p in sorted(Path(input_dir).iterdir())
+            if p.suffix.lower() in ['.jpg', '.jpeg', '.png']]
+
 
-def process_folder(input_dir, output_dir):
-    input_dir = Path(input_dir)
+def process_folder(input_dir, output_dir, height=None, workers=1):
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
-    for img_path in input_dir.glob('*'):
-        if not img_path.suffix.lower() in ['.jpg', '.jpeg', '.png']:
-            continue
-        image = cv2.imread(str(img_path))
-        if image is None:
-            continue
-        rotated, _ = align_face(image)
-        crop = crop_portrait(rotated)
-        if crop is None:
-            crop = rotated
-        output_path = output_dir / img_path.name
-        cv2.imwrite(str(output_path), crop)
-        print(f"Processed {img_path} -> {output_path}")
+    run_tasks(partial(format_file, output_dir=output_dir, height=height),
+              image_paths(input_dir), workers)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Format photos for portrait.')
     parser.add_argument('input_dir', help='Directory with input images')
     parser.add_argument('output_dir', help='Directory for processed images')
+    parser.add_argument('--height', type=int, help='Height of the portraits in pixels (default: as cropped)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to use')
     args = parser.parse_args()
-    process_folder(args.input_dir, args.output_dir)
+    process_folder(args.input_dir, args.output_dir, args.height, args.workers)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Format and fix portraits in one pass.
+
+Runs ``format.py`` (rotate and crop) and ``portraitfix/process.py`` (enhance
+and blur) on each photo in memory: the photo is decoded once, the fixes run
+on the cropped portrait only, and the result is encoded once.
+"""
+
+import argparse
+from functools import partial
+from pathlib import Path
+import sys
+import cv2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'shared'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'portraitfix'))
+from imageload import load_image
+from mpmodels import get_models
+from format import format_image, image_paths, run_tasks
+from process import fix_image, skipped_fixes
+
+
+def format_and_fix(path, output_dir, enhance=False, blur=False, auto_enhance=False,
+                   auto_blur=False, blur_quality=None, height=None):
+    """Rotate, crop and fix one photo, save it under the same name and
+    return a progress message."""
+    models = get_models()
+    try:
+        image = load_image(path, bgr=True)
+    except OSError:
+        return f"Skipped {path}"
+    crop = format_image(image, models, height)
+    row = {'file': path.name}
+    crop = fix_image(crop, row, enhance, blur, auto_enhance, auto_blur,
+                     blur_quality, models)
+    output_path = output_dir / path.name
+    cv2.imwrite(str(output_path), crop)
+    return '; '.join([f"Processed {path} -> {output_path}"] + skipped_fixes(row))
+
+
+def process_folder(input_dir, output_dir, enhance=False, blur=False, auto_enhance=False,
+                   auto_blur=False, blur_quality=None, height=None, workers=1):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    task = partial(format_and_fix, output_dir=output_dir, enhance=enhance, blur=blur,
+                   auto_enhance=auto_enhance, auto_blur=auto_blur,
+                   blur_quality=blur_quality, height=height)
+    run_tasks(task, image_paths(input_dir), workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Format portraits and fix their colors and background.')
+    parser.add_argument('input_dir', help='Directory with input images')
+    parser.add_argument('output_dir', help='Directory for processed images')
+    parser.add_argument('--enhance', action='store_true', help='Improve color curves')
+    parser.add_argument('--blur', action='store_true', help='Blur background behind subject')
+    parser.add_argument('--auto-enhance', action='store_true', help='Enhance colors only if washed out')
+    parser.add_argument('--auto-blur', action='store_true', help='Blur background only if not already blurred')
+    parser.add_argument('--blur-quality', type=float,
+                        help='Fast blur at this fraction of full size (see portraitfix)')
+    parser.add_argument('--height', type=int, help='Height of the portraits in pixels (default: as cropped)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to use')
+    args = parser.parse_args()
+    process_folder(args.input_dir, args.output_dir, args.enhance, args.blur,
+                   args.auto_enhance, args.auto_blur, args.blur_quality, args.height,
+                   args.workers)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Compare full-resolution and downscaled face detection on sample photos."""
+
+import argparse
+from pathlib import Path
+import time
+import cv2
+import numpy as np
+
+from rename import CASCADE, detect_face, load_image
+
+SAMPLES = Path(__file__).resolve().parent.parent / 'photoformat' / 'sample_images'
+
+
+def overlap(a, b) -> float:
+    """Return the intersection over union of two (x, y, w, h) boxes."""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1 = min(a[0] + a[2], b[0] + b[2])
+    y1 = min(a[1] + a[3], b[1] + b[3])
+    inter = max(0, x1 - x0) * max(0, y1 - y0)
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+
+def timed(func, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark face detection')
+    parser.add_argument('image_dir', nargs='?', default=str(SAMPLES),
+                        help='Folder of photos (default: photoformat samples)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per image and method')
+    args = parser.parse_args()
+
+    total_full = total_fast = 0.0
+    for path in sorted(Path(args.image_dir).iterdir()):
+        try:
+            img = load_image(path)
+        except Exception as e:
+            print(f'Could not load {path}: {e}')
+            continue
+        gray = cv2.cvtColor(np.array(img.convert('RGB')), cv2.COLOR_RGB2GRAY)
+        full, t_full = timed(lambda: CASCADE.detectMultiScale(
+            gray, scaleFactor=1.1, minNeighbors=5), args.repeat)
+        fast, t_fast = timed(lambda: detect_face(gray), args.repeat)
+        total_full += t_full
+        total_fast += t_fast
+        if fast is None:
+            agree = 'no face' if len(full) == 0 else 'missed'
+        else:
+            best = max((overlap(fast, box) for box in full), default=0.0)
+            agree = f'IoU {best:.2f}'
+        print(f'{path.name}: {img.width}x{img.height} full {t_full * 1000:.0f} ms, '
+              f'downscaled {t_fast * 1000:.0f} ms, {agree}')
+    if total_fast:
+        print(f'Total: full {total_full:.2f}s, downscaled {total_fast:.2f}s, '
+              f'speedup {total_full / total_fast:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
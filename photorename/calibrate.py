@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Suggest a FACE_THRESHOLD for rename.py from correctly named photos."""
+
+import argparse
+from pathlib import Path
+import numpy as np
+
+from rename import FACE_THRESHOLD, face_distances, face_vector, load_frame
+
+
+def person_of(path: Path) -> str:
+    """Return the person a renamed photo such as ``Alice-2.jpeg`` belongs to."""
+    return path.stem.split('-', 1)[0]
+
+
+def best_threshold(same: np.ndarray, different: np.ndarray) -> float:
+    """Return the threshold with the best balanced accuracy."""
+    candidates = np.unique(np.concatenate([same, different]))
+    best, best_score = FACE_THRESHOLD, -1.0
+    for low, high in zip(candidates[:-1], candidates[1:]):
+        threshold = (low + high) / 2
+        score = (same < threshold).mean() + (different >= threshold).mean()
+        if score > best_score:
+            best, best_score = threshold, score
+    return float(best)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Suggest a face distance threshold from a folder of photos '
+                    'named like rename.py output (Name-1.jpeg, Name-badge.jpeg)')
+    parser.add_argument('photo_dir', help='Folder with correctly named photos')
+    args = parser.parse_args()
+
+    people, vectors = [], []
+    for path in sorted(Path(args.photo_dir).iterdir()):
+        if not path.is_file():
+            continue
+        try:
+            vec = face_vector(load_frame(path)[0].gray)
+        except Exception as e:
+            print(f'Could not load {path}: {e}')
+            continue
+        if vec is None:
+            print(f'No face found in {path.name}')
+            continue
+        people.append(person_of(path))
+        vectors.append(vec)
+    if len(vectors) < 2:
+        print('Need at least two photos with faces')
+        return
+
+    dist = face_distances(np.stack(vectors).astype(np.float64))
+    people = np.array(people)
+    upper = np.triu(np.ones(dist.shape, dtype=bool), k=1)
+    same_person = people[:, None] == people[None, :]
+    same = dist[upper & same_person]
+    different = dist[upper & ~same_person]
+    if not len(different):
+        print('Need photos of at least two people')
+        return
+    closest = different.min()
+    print(f'Closest photos of different people: {closest:.3f} apart')
+    if closest < FACE_THRESHOLD:
+        print(f'Warning: FACE_THRESHOLD {FACE_THRESHOLD} links different people')
+    if not len(same):
+        print('Add two photos of someone to suggest a threshold')
+        return
+
+    for label, values in (('same person', same), ('different people', different)):
+        p10, p50, p90 = np.percentile(values, [10, 50, 90])
+        print(f'{label}: {len(values)} pairs, 10%/50%/90% = '
+              f'{p10:.3f}/{p50:.3f}/{p90:.3f}')
+    threshold = best_threshold(same, different)
+    print(f'Current FACE_THRESHOLD: {FACE_THRESHOLD}')
+    print(f'Suggested FACE_THRESHOLD: {threshold:.2f} '
+          f'({(same < threshold).mean():.0%} of same-person pairs linked, '
+          f'{(different >= threshold).mean():.0%} of other pairs kept apart)')
+
+
+if __name__ == '__main__':
+    main()
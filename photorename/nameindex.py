@@ -0,0 +1,127 @@
+"""Fast lookup of spreadsheet names in OCR text.
+
+All normalised names are compiled once into an Aho-Corasick automaton so a
+single pass over the OCR text finds every name it contains, whatever the size
+of the roster.  When no name occurs exactly, names are split into pieces that
+are also in the automaton: a name within ``k`` edits of the text must contain
+one of its ``k + 1`` pieces unchanged, so only names with a matching piece are
+checked with the (slower) edit-distance comparison.
+"""
+
+from collections import deque
+
+
+def normalize(text: str) -> str:
+    """Lower-case ``text`` and drop everything but letters and digits."""
+    return "".join(ch.lower() for ch in text if ch.isalnum())
+
+
+def allowed_edits(length: int) -> int:
+    """Number of OCR mistakes tolerated in a normalised name of ``length``."""
+    if length < 6:
+        return 0
+    if length < 12:
+        return 1
+    return 2
+
+
+def substring_distance(pattern: str, text: str) -> int:
+    """Return the smallest edit distance between ``pattern`` and any substring of ``text``."""
+    col = list(range(len(pattern) + 1))
+    best = col[-1]
+    for ch in text:
+        diag = col[0]
+        col[0] = 0
+        for i in range(1, len(col)):
+            cur = min(col[i] + 1, col[i - 1] + 1, diag + (pattern[i - 1] != ch))
+            diag = col[i]
+            col[i] = cur
+        best = min(best, col[-1])
+    return best
+
+
+class NameIndex:
+    """Multi-pattern matcher for a fixed list of names."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.patterns = [normalize(str(name)) for name in self.names]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for i, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            self._add(pattern, (i, None))
+            k = allowed_edits(len(pattern))
+            if k:
+                step = len(pattern) // (k + 1)
+                for p in range(k + 1):
+                    start = p * step
+                    end = len(pattern) if p == k else start + step
+                    self._add(pattern[start:end], (i, start))
+        self._build()
+
+    def _add(self, word: str, entry):
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(word), entry))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _scan(self, text: str):
+        node = 0
+        for end, ch in enumerate(text, 1):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, entry in self._out[node]:
+                yield end - length, entry
+
+    def find(self, normalized: str):
+        """Return ``(name, edits)`` for the best name in ``normalized`` text.
+
+        An exact occurrence wins, earliest in the roster first.  Otherwise the
+        name with the fewest edits within its :func:`allowed_edits` is used.
+        Returns ``(None, None)`` if nothing matches.
+        """
+        exact = None
+        candidates = set()
+        for start, (i, offset) in self._scan(normalized):
+            if offset is None:
+                if exact is None or i < exact:
+                    exact = i
+            elif exact is None:
+                candidates.add((i, start - offset))
+        if exact is not None:
+            return self.names[exact], 0
+        best = None
+        for i, start in sorted(candidates):
+            pattern = self.patterns[i]
+            k = allowed_edits(len(pattern))
+            window = normalized[max(0, start - k):start + len(pattern) + k]
+            edits = substring_distance(pattern, window)
+            if edits <= k and (best is None or (edits, i) < best):
+                best = (edits, i)
+        if best is None:
+            return None, None
+        return self.names[best[1]], best[0]
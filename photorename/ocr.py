@@ -0,0 +1,82 @@
+"""Tesseract OCR that stays loaded between calls.
+
+``pytesseract`` starts a new ``tesseract`` process for every image, which
+writes the image to a temporary file and loads the language model again each
+time.  When the optional ``tesserocr`` bindings are installed, an
+:class:`OcrEngine` instead keeps one Tesseract instance per process and passes
+images to it in memory.  Without them, batches are still sent to a single
+``tesseract`` run so the model is loaded once per batch.
+"""
+
+import os
+import tempfile
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+
+class OcrEngine:
+    """Reusable OCR engine for one page segmentation mode."""
+
+    def __init__(self, psm: int = 6, lang: str = 'eng'):
+        self.psm = psm
+        self.lang = lang
+        self._api = None
+        if tesserocr is not None:
+            self._api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+
+    @property
+    def config(self) -> str:
+        return f'--psm {self.psm}'
+
+    def recognize(self, img) -> str:
+        """Return the text in PIL image ``img``."""
+        if self._api is None:
+            return pytesseract.image_to_string(img, lang=self.lang,
+                                               config=self.config)
+        self._api.SetImage(img)
+        return self._api.GetUTF8Text()
+
+    def recognize_batch(self, images) -> list[str]:
+        """Return the text of each PIL image in ``images``."""
+        images = list(images)
+        if self._api is not None or len(images) < 2:
+            return [self.recognize(img) for img in images]
+        # tesseract reads a text file listing images as one multi-page input
+        # and separates the pages of its output with form feeds
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, img in enumerate(images):
+                path = os.path.join(tmp, f'{i}.png')
+                img.save(path)
+                paths.append(path)
+            listing = os.path.join(tmp, 'images.txt')
+            with open(listing, 'w') as f:
+                f.write('\n'.join(paths) + '\n')
+            text = pytesseract.image_to_string(listing, lang=self.lang,
+                                               config=self.config)
+        pages = text.split('\f')
+        if len(pages) < len(images):
+            return [self.recognize(img) for img in images]
+        return pages[:len(images)]
+
+    def close(self):
+        if self._api is not None:
+            self._api.End()
+            self._api = None
+
+
+_engines = {}
+
+
+def get_engine(psm: int = 6) -> OcrEngine:
+    """Return this process's engine for ``psm``, creating it on first use."""
+    # keyed by pid, see shared/workers.py
+    key = (os.getpid(), psm)
+    engine = _engines.get(key)
+    if engine is None:
+        engine = _engines[key] = OcrEngine(psm)
+    return engine
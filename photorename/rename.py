@@ -1,128 +1,747 @@
 import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from bisect import bisect_right
+from dataclasses import dataclass, replace
+from datetime import datetime
+from itertools import repeat
+import json
+import os
+import threading
 from pathlib import Path
 import shutil
+import sys
+import time
 import pandas as pd
-import pytesseract
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 import cv2
-from PIL import Image, ImageOps
+from PIL import Image
 import pillow_heif
 import numpy as np
 
-def load_image(path: Path) -> Image.Image:
-    """Load image handling JPEG/PNG/HEIF and correct orientation."""
-    suffix = path.suffix.lower()
-    if suffix in {'.heic', '.heif'}:
-        heif_file = pillow_heif.read_heif(str(path))
-        img = Image.frombytes(
-            heif_file.mode, heif_file.size, heif_file.data, 'raw')
-    else:
-        img = Image.open(path)
-    return ImageOps.exif_transpose(img)
+from nameindex import NameIndex, normalize
+from ocr import get_engine
+from store import AnalysisStore, default_store_path, file_digest
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'shared'))
+from badgedetect import character_boxes, find_badge, text_lines, text_strips
+from imageload import load_image, load_scaled
+from workers import worker_pool
 
-def find_badge(image: np.ndarray):
-    """Return bounding box of the most likely badge or ``None``."""
-    scale = 1000.0 / image.shape[1]
-    if scale < 1.0:
-        small = cv2.resize(image, (0, 0), fx=scale, fy=scale)
-        factor = 1.0 / scale
-    else:
-        small = image
-        factor = 1.0
-
-    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    _, thresh = cv2.threshold(blur, 0, 255,
-                             cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE,
-                              np.ones((5, 5), np.uint8))
-
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL,
-                                   cv2.CHAIN_APPROX_SIMPLE)
-    img_area = small.shape[0] * small.shape[1]
-
-    best_rect = None
-    best_score = 0.0
-    for cnt in contours:
-        area = cv2.contourArea(cnt)
-        if area < img_area * 0.005:
-            continue
-        x, y, w, h = cv2.boundingRect(cnt)
-        aspect = w / float(h)
-        if not (0.4 <= aspect <= 2.5):
-            continue
+@dataclass
+class Frame:
+    """A decoded photo as the BGR array and the grayscale array that badge
+    detection, OCR and face detection all share."""
+    bgr: np.ndarray
+    gray: np.ndarray
 
-        rect_area = float(w * h)
-        rectangularity = area / rect_area
-        whiteness = np.mean(gray[y : y + h, x : x + w]) / 255.0
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.gray.shape[1], self.gray.shape[0]
 
-        score = (whiteness ** 3) * (rectangularity ** 2) / ((area / img_area) ** 0.5)
+def make_frame(img: np.ndarray) -> Frame:
+    """Return the :class:`Frame` of a BGR array."""
+    return Frame(img, cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
 
-        if score > best_score:
-            best_score = score
-            best_rect = (
-                int(x * factor),
-                int(y * factor),
-                int(w * factor),
-                int(h * factor),
-            )
-    return best_rect
+# Fewer aligned character-like regions than this means the frame has no text.
+TEXT_MIN_CHARS = 4
+# Characters on a badge crop may be much taller relative to it than in a frame.
+BADGE_GLYPH_MAX = 0.5
 
+def _has_text(lines) -> bool:
+    """Return whether the :func:`badgedetect.text_lines` of a frame could be
+    text; frames with fewer than ``TEXT_MIN_CHARS`` characters on lines are
+    confidently text-free."""
+    # too cluttered to judge cheaply; let OCR decide
+    return lines is None or sum(line.chars for line in lines) >= TEXT_MIN_CHARS
 
-def badgecrop(img: Image.Image):
-    """Return a cropped badge PIL image if one is detected."""
-    bgr = cv2.cvtColor(np.array(img.convert("RGB")), cv2.COLOR_RGB2BGR)
-    rect = find_badge(bgr)
-    if rect is None:
-        return None
-    x, y, w, h = rect
-    badge = bgr[y : y + h, x : x + w]
-    rgb = cv2.cvtColor(badge, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(rgb)
-
-def detect_name(img: Image.Image, valid_names, badge_dir: Path | None = None,
-                orig_path: Path | None = None):
-    """Return a matching name if found and whether any text was detected."""
-    crop = badgecrop(img)
-    ocr_img = crop if crop is not None else img
-    if crop is not None and badge_dir is not None and orig_path is not None:
-        dest = badge_dir / f"{orig_path.stem}-badgecrop.jpeg"
-        save_jpeg(crop, dest)
-
-    # OCR the badge crop if available otherwise the entire image.  In practice
-    # badges may sit well below the face and the simple face-based crop used
-    # previously often missed the text.
-    text = pytesseract.image_to_string(ocr_img, config='--psm 6')
+def read_badge_text(frame: Frame, badge_dir: Path | None = None,
+                    orig_path: Path | None = None):
+    """Return the badge rectangle (or ``None``), the OCR text of a
+    :class:`Frame` and whether OCR was skipped because it has no text.
+
+    Only the lines of text found in the badge, or in the whole frame if there
+    is no badge, are sent to OCR as small normalised strips; see
+    :func:`badgedetect.text_strips`.
+    """
+    rect = find_badge(frame.gray)
+    gray = frame.gray
+    max_height = 0.2
+    if rect is not None:
+        x, y, w, h = rect
+        gray = gray[y : y + h, x : x + w]
+        max_height = BADGE_GLYPH_MAX
+        if badge_dir is not None and orig_path is not None:
+            dest = badge_dir / f"{orig_path.stem}-badgecrop.jpeg"
+            crop = frame.bgr[y : y + h, x : x + w]
+            save_jpeg(Image.fromarray(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)),
+                      dest)
+
+    # In practice badges may sit well below the face and the simple
+    # face-based crop used previously often missed the text, so without a
+    # badge the whole frame is searched.  Full-frame OCR is by far the most
+    # expensive step, so frames without anything text-like skip it.
+    lines = text_lines(character_boxes(gray, max_height))
+    if rect is None and not _has_text(lines):
+        print('no text regions, skipping OCR')
+        return rect, '', True
+    strips = text_strips(gray, lines) if lines else []
+    if strips:
+        text = '\n'.join(get_engine(psm=7).recognize_batch(
+            Image.fromarray(strip) for strip in strips))
+    else:
+        # no lines found (or too many to group): read the region as a page
+        text = get_engine(psm=6).recognize(Image.fromarray(gray))
     print('text in image', text)
+    return rect, text, False
+
+def match_name(text: str, index: NameIndex):
+    """Return the name found in OCR ``text`` and whether any text was present.
+
+    Small OCR mistakes are tolerated; see :class:`nameindex.NameIndex`.
+    """
     cleaned = "".join(ch for ch in text if ch.isalnum() or ch.isspace()).strip()
-    normalized = "".join(ch.lower() for ch in cleaned if ch.isalnum())
+    normalized = normalize(cleaned)
     print('normalized text', normalized)
-    for name in valid_names:
-        name_norm = "".join(ch.lower() for ch in name if ch.isalnum())
-        if name_norm in normalized:
-            print('found name', name_norm)
-            return name, True
+    name, edits = index.find(normalized)
+    if name is not None:
+        print('found name', name if not edits else f'{name} ({edits} edits)')
+        return name, True
     return None, bool(cleaned)
 
 CASCADE = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-FACE_THRESHOLD = 20.0
-
-def face_vector(img: Image.Image):
-    array = np.array(img.convert('RGB'))
-    gray = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
-    # OpenCV Haar cascade returns a list of faces; we only use the first
-    faces = CASCADE.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
-    if len(faces) == 0:
+# Distance between face descriptors below which two photos show the same
+# person.  Not yet calibrated on a labelled shoot: the four different people
+# in photoformat/sample_images are at least 0.78 apart, while brightness,
+# crop, scale, rotation and JPEG variations of one photo mostly stay below
+# 0.55.  Run calibrate.py on a correctly named output folder to tune it, and
+# again whenever the face descriptor changes (see DETECTOR_VERSION); one
+# false link merges the groups of two people.
+FACE_THRESHOLD = 0.65
+# Images further apart than this in the sorted list are never linked directly,
+# but a chain of links lets a group span any number of shots.
+FACE_WINDOW = 5
+FACE_SIZE = 100
+FACE_GRID = 4
+
+def lbp_descriptor(face: np.ndarray) -> np.ndarray:
+    """Return a compact texture descriptor of a grayscale face patch.
+
+    Each pixel gets a rotation-invariant uniform local binary pattern code
+    (0-8 brighter neighbours, or 9 for irregular patterns), which does not
+    change with overall brightness.  Codes are histogrammed over a
+    ``FACE_GRID`` x ``FACE_GRID`` grid and each cell histogram is square-root
+    normalised so that Euclidean distance behaves like the Hellinger distance.
+    """
+    centre = face[1:-1, 1:-1]
+    h, w = centre.shape
+    bits = np.stack([face[1 + dy:1 + dy + h, 1 + dx:1 + dx + w] >= centre
+                     for dy, dx in ((-1, -1), (-1, 0), (-1, 1), (0, 1),
+                                    (1, 1), (1, 0), (1, -1), (0, -1))])
+    ones = bits.sum(axis=0)
+    transitions = (bits != np.roll(bits, 1, axis=0)).sum(axis=0)
+    codes = np.where(transitions <= 2, ones, 9)
+    cells = []
+    for rows in np.array_split(codes, FACE_GRID, axis=0):
+        for cell in np.array_split(rows, FACE_GRID, axis=1):
+            hist = np.bincount(cell.ravel(), minlength=10).astype(np.float32)
+            cells.append(np.sqrt(hist / hist.sum()))
+    return np.concatenate(cells)
+
+FACE_DETECT_WIDTH = 1000
+
+def detect_face(gray: np.ndarray, badge=None):
+    """Return the full-resolution box (x, y, w, h) of a face or ``None``.
+
+    Like :func:`find_badge`, detection runs on a copy scaled down to
+    ``FACE_DETECT_WIDTH`` and the box is mapped back.  With a ``badge``
+    rectangle the area above and around the badge is searched first, since
+    that is where the person holding it is; the whole frame is the fallback.
+    """
+    scale = FACE_DETECT_WIDTH / gray.shape[1]
+    if scale < 1.0:
+        small = cv2.resize(gray, (0, 0), fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA)
+    else:
+        small = gray
+        scale = 1.0
+    regions = []
+    if badge is not None:
+        bx, by, bw, bh = (int(v * scale) for v in badge)
+        top = max(1, by + bh // 2)
+        regions.append((max(0, bx - bw), 0, min(small.shape[1], bx + 2 * bw), top))
+    regions.append((0, 0, small.shape[1], small.shape[0]))
+    for x0, y0, x1, y1 in regions:
+        # OpenCV Haar cascade returns a list of faces; we only use the first
+        faces = CASCADE.detectMultiScale(small[y0:y1, x0:x1],
+                                         scaleFactor=1.1, minNeighbors=5)
+        if len(faces):
+            x, y, w, h = faces[0]
+            return (int((x + x0) / scale), int((y + y0) / scale),
+                    int(w / scale), int(h / scale))
+    return None
+
+def face_vector(gray: np.ndarray, badge=None):
+    """Return the descriptor of the first detected face or ``None``.
+
+    ``gray`` is the grayscale array of the photo.
+    """
+    box = detect_face(gray, badge)
+    if box is None:
         return None
-    x, y, w, h = faces[0]
+    x, y, w, h = box
     face_img = gray[y:y+h, x:x+w]
-    face_img = cv2.resize(face_img, (100, 100))
-    return face_img.flatten() / 255.0
+    face_img = cv2.resize(face_img, (FACE_SIZE, FACE_SIZE),
+                          interpolation=cv2.INTER_AREA)
+    return lbp_descriptor(face_img)
+
+ANALYSIS_CACHE_SIZE = 64
+# Bump whenever badge detection, OCR or face vectors change so that stored
+# analyses from older runs are ignored.  A change to the face vectors or to
+# the frames they are computed from also needs FACE_THRESHOLD rechecked.
+DETECTOR_VERSION = 9
+# Photos are analysed at this size rather than full resolution.  The badge
+# and face detectors scale down to about 1000 pixels themselves, but the
+# badge crop handed to OCR needs to keep the text legible.
+ANALYSIS_SIZE = 2000
+
+@dataclass
+class Analysis:
+    """Everything the matcher needs to know about one image."""
+    size: tuple[int, int]
+    badge: tuple[int, int, int, int] | None
+    text: str
+    face: np.ndarray | None
+    name: str | None = None
+    has_text: bool = False
+    # how the text was obtained; only known for images analysed in this run
+    ocr_skipped: bool = False
+    text_time: float = 0.0
+    # seconds spent decoding (unless prefetched) and analysing the image
+    time: float = 0.0
+    # earlier near-identical frame whose analysis this one reuses
+    inherited_from: Path | None = None
+
+def analyze_image(frame: Frame, badge_dir: Path | None = None,
+                  orig_path: Path | None = None, scale: float = 1.0) -> Analysis:
+    """Run badge detection, OCR and face detection on a decoded :class:`Frame`.
+
+    The frame may be a reduced copy of the photo; ``scale`` maps its pixels
+    back to full resolution, which is what the result is reported in.  The
+    result does not depend on the spreadsheet; names are matched later with
+    :func:`match_name`.
+    """
+    start = time.perf_counter()
+    badge, text, skipped = read_badge_text(frame, badge_dir, orig_path)
+    text_time = time.perf_counter() - start
+    face = face_vector(frame.gray, badge)
+    size = tuple(round(v * scale) for v in frame.size)
+    if badge is not None:
+        badge = tuple(int(v * scale) for v in badge)
+    return Analysis(size, badge, text, face,
+                    ocr_skipped=skipped, text_time=text_time)
+
+def analyze_path(path: Path, badge_dir: Path | None = None,
+                 prefetched=None) -> Analysis | None:
+    """Load and analyse ``path``; return ``None`` if it cannot be loaded.
+
+    A :class:`Prefetched` frame that was already decoded is used as is.
+    """
+    start = time.perf_counter()
+    try:
+        if prefetched is not None and prefetched.error is not None:
+            raise prefetched.error
+        if prefetched is not None and prefetched.frame is not None:
+            frame, scale = prefetched.frame, prefetched.scale
+        else:
+            print('loading image', path)
+            frame, scale = load_frame(path)
+    except Exception as e:
+        print(f'Could not load {path}: {e}')
+        return None
+    result = analyze_image(frame, badge_dir, path, scale)
+    result.time = time.perf_counter() - start
+    return result
+
+def load_frame(path: Path):
+    """Decode ``path`` at ``ANALYSIS_SIZE``; return ``(frame, scale)``."""
+    bgr, scale = load_scaled(path, ANALYSIS_SIZE, bgr=True)
+    return make_frame(bgr), scale
+
+PREFETCH_FRAMES = 4
+
+@dataclass
+class Prefetched:
+    """What the background reader found out about one file."""
+    digest: str | None = None
+    frame: Frame | None = None
+    scale: float = 1.0
+    error: Exception | None = None
+
+class Prefetcher:
+    """Reads and decodes upcoming images on a background thread.
+
+    Images are read in shooting order while the main thread is busy with OCR
+    and face detection, with at most ``budget`` decoded frames held at once.
+    With a ``store_path`` the reader also hashes each file and skips decoding
+    the ones whose analysis is already stored.  The main thread collects
+    frames with :meth:`take`; frames it no longer needs are dropped with
+    :meth:`release`.
+    """
+
+    def __init__(self, images, budget: int = PREFETCH_FRAMES,
+                 store_path: Path | None = None, version: int | None = None):
+        self.images = list(images)
+        self.budget = budget
+        self.store_path = store_path
+        self.version = version
+        self._cond = threading.Condition()
+        self._ready = {}
+        self._claimed = set()
+        self._busy = None
+        self._decoded = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def take(self, path: Path) -> Prefetched | None:
+        """Return what was read for ``path``, or ``None`` if it was not read.
+
+        Waits if ``path`` is being read right now.  Afterwards the reader
+        leaves ``path`` alone.
+        """
+        with self._cond:
+            while self._busy == path:
+                self._cond.wait()
+            self._claimed.add(path)
+            entry = self._ready.pop(path, None)
+            if entry is not None and entry.frame is not None:
+                self._decoded -= 1
+                self._cond.notify_all()
+            return entry
+
+    def release(self, path: Path):
+        """Drop anything read for ``path``; it is no longer needed."""
+        self.take(path)
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._ready.clear()
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        store = None
+        if self.store_path is not None and Path(self.store_path).exists():
+            # sqlite connections cannot be shared between threads
+            store = AnalysisStore(self.store_path, self.version, readonly=True)
+        try:
+            for path in self.images:
+                with self._cond:
+                    while not self._stop and self._decoded >= self.budget:
+                        self._cond.wait()
+                    if self._stop:
+                        return
+                    if path in self._claimed:
+                        continue
+                    self._busy = path
+                entry = self._read(path, store)
+                with self._cond:
+                    self._busy = None
+                    if path not in self._claimed and not self._stop:
+                        self._ready[path] = entry
+                        if entry.frame is not None:
+                            self._decoded += 1
+                    self._cond.notify_all()
+        finally:
+            if store is not None:
+                store.close()
+
+    def _read(self, path: Path, store) -> Prefetched:
+        entry = Prefetched()
+        try:
+            if store is not None:
+                entry.digest = file_digest(path)
+                if store.get(entry.digest) is not None:
+                    return entry
+            entry.frame, entry.scale = load_frame(path)
+        except Exception as e:
+            entry.error = e
+        return entry
+
+def digest_path(path: Path) -> str | None:
+    """Return the content digest of ``path`` or ``None`` if it is unreadable."""
+    try:
+        return file_digest(path)
+    except OSError as e:
+        print(f'Could not load {path}: {e}')
+        return None
+
+def save_badge_crop(path: Path, badge, badge_dir: Path):
+    """Write the badge crop of ``path`` unless it already exists."""
+    dest = badge_dir / f"{path.stem}-badgecrop.jpeg"
+    if dest.exists():
+        return
+    x, y, w, h = badge
+    save_jpeg(load_image(path).crop((x, y, x + w, y + h)), dest)
+
+class AnalysisStats:
+    """Counters for the end-of-run report."""
+
+    def __init__(self):
+        self.analysed = 0
+        self.stored = 0
+        self.repeats = []
+        self.full_frame_times = []
+        self.skipped_times = []
+        self.times = []
+
+    def record(self, result: Analysis | None):
+        if result is None:
+            return
+        self.analysed += 1
+        self.times.append(result.time)
+        if result.badge is None:
+            if result.ocr_skipped:
+                self.skipped_times.append(result.text_time)
+            else:
+                self.full_frame_times.append(result.text_time)
+
+    def report(self):
+        print(f'Analysed {self.analysed} images, '
+              f'{self.stored} taken from the store')
+        if self.times:
+            print(f'Analysis took {np.mean(self.times):.2f}s per image')
+        peak = peak_memory()
+        if peak is not None:
+            print(f'Peak memory {peak[0]:.0f} MB'
+                  + (f', {peak[1]:.0f} MB in child processes' if peak[1] else ''))
+        if self.repeats:
+            total = self.analysed + len(self.repeats)
+            print(f'Skipped badge and OCR analysis of {len(self.repeats)} of '
+                  f'{total} images ({100.0 * len(self.repeats) / total:.0f}%) '
+                  f'that repeat the previous frame:')
+            for path, prev in self.repeats:
+                print(f'  {path.name} -> {prev.name}')
+        no_badge = len(self.skipped_times) + len(self.full_frame_times)
+        if not no_badge:
+            return
+        skipped = len(self.skipped_times)
+        line = (f'Skipped full-frame OCR on {skipped} of {no_badge} images '
+                f'without a badge ({100.0 * skipped / no_badge:.0f}%)')
+        if skipped and self.full_frame_times:
+            saved = skipped * (np.mean(self.full_frame_times)
+                               - np.mean(self.skipped_times))
+            line += f', saving about {saved:.1f}s'
+        print(line)
+
+def peak_memory():
+    """Return the peak resident memory in MB of this process and of its
+    largest finished child process, or ``None`` where it cannot be measured."""
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    unit = 1 << 20 if sys.platform == 'darwin' else 1 << 10
+    return tuple(resource.getrusage(who).ru_maxrss / unit
+                 for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+DUP_HASH_SIZE = 8
+# Frames whose 64-bit difference hashes differ in at most this many bits may
+# be repeats of the same shot.  The hash cannot see who is in the frame, so a
+# candidate only counts as a repeat if its own face matches too.
+DUP_DISTANCE = 4
+
+def image_hash(path: Path) -> int | None:
+    """Return a difference hash of a tiny grayscale thumbnail of ``path``.
+
+    The file is decoded at reduced size; ``None`` if it cannot be read.
+    """
+    try:
+        img = load_image(path, 16 * DUP_HASH_SIZE)
+        small = img.convert('L').resize((DUP_HASH_SIZE + 1, DUP_HASH_SIZE),
+                                        Image.BILINEAR)
+    except Exception:
+        return None
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def decode(path: Path, prefetched: Prefetched | None = None) -> Prefetched:
+    """Return ``prefetched`` with the frame of ``path`` decoded if it was not."""
+    if prefetched is None:
+        prefetched = Prefetched()
+    if prefetched.frame is None and prefetched.error is None:
+        try:
+            prefetched.frame, prefetched.scale = load_frame(path)
+        except Exception as e:
+            prefetched.error = e
+    return prefetched
+
+def same_face(a: np.ndarray | None, b: np.ndarray | None) -> bool:
+    """Return True if two face descriptors (or two missing faces) match."""
+    if a is None or b is None:
+        return a is None and b is None
+    return float(np.linalg.norm(a - b)) < FACE_THRESHOLD
+
+def previous_frames(images, sessions=None) -> dict:
+    """Map each image to the one taken just before it in the same session."""
+    sessions = sessions or [(0, len(images))]
+    return {images[i]: images[i - 1]
+            for start, end in sessions for i in range(start + 1, end)}
+
+class AnalysisCache:
+    """Bounded LRU of per-image analyses.
+
+    Badge photos look ahead and regular photos look around themselves, so the
+    same neighbours are requested many times.  Each image is decoded and
+    analysed once while it stays within the most recent ``maxsize`` lookups;
+    only the small analysis records are kept, never the decoded pixels.  With
+    a ``store`` the detector output also survives between runs, so unchanged
+    images are never decoded again for analysis.
+
+    ``previous`` maps images to the frame shot just before them (see
+    :func:`previous_frames`).  A frame whose :func:`image_hash` is within
+    ``dup_distance`` bits of its predecessor's and whose face matches it is a
+    repeat of the same pose: it inherits the predecessor's badge and text
+    instead of being read again.
+
+    With a ``prefetcher`` files are hashed and decoded ahead of time on a
+    background thread; see :class:`Prefetcher`.
+    """
+
+    def __init__(self, valid_names, badge_dir: Path | None = None,
+                 maxsize: int | None = ANALYSIS_CACHE_SIZE,
+                 store: AnalysisStore | None = None, previous=None,
+                 dup_distance: int = DUP_DISTANCE,
+                 prefetcher: Prefetcher | None = None):
+        self.name_index = NameIndex(valid_names)
+        self.badge_dir = badge_dir
+        self.maxsize = maxsize
+        self.store = store
+        self.previous = previous or {}
+        self.dup_distance = dup_distance
+        self.prefetcher = prefetcher
+        self.stats = AnalysisStats()
+        self._entries = OrderedDict()
+        self._hashes = {}
+
+    def get(self, path: Path) -> Analysis | None:
+        """Return the analysis of ``path`` or ``None`` if it cannot be loaded."""
+        if path in self._entries:
+            self._entries.move_to_end(path)
+            return self._entries[path]
+        pre = None
+        if self.prefetcher is not None:
+            pre = self.prefetcher.take(path)
+        digest = None
+        if self.store is not None:
+            digest = pre.digest if pre is not None else None
+            if digest is None:
+                digest = digest_path(path)
+            if digest is None:
+                return self._add(path, None)
+            result = self._stored(path, digest)
+            if result is not None:
+                return self._add(path, result)
+        result = None
+        if self._is_repeat(path):
+            pre = decode(path, pre)
+            result = self._inherit(path, pre)
+        if result is None:
+            result = analyze_path(path, self.badge_dir, pre)
+            self.stats.record(result)
+        self._save(digest, result)
+        return self._add(path, result)
+
+    def precompute(self, images, workers: int):
+        """Analyse all ``images`` on ``workers`` processes up front.
+
+        The cache stops evicting so that the sequential matching pass that
+        follows never has to analyse anything itself.
+        """
+        self.maxsize = None
+        with worker_pool(workers) as pool:
+            if self.store is None:
+                todo = [(path, None) for path in images]
+            else:
+                todo = []
+                digests = pool.map(digest_path, images, chunksize=16)
+                for path, digest in zip(images, digests):
+                    result = None if digest is None else self._stored(path, digest)
+                    if digest is None or result is not None:
+                        self._add(path, result)
+                    else:
+                        todo.append((path, digest))
+            if self.dup_distance > 0:
+                need = {path for path, _ in todo}
+                need |= {self.previous[path] for path in need
+                         if path in self.previous}
+                need = sorted(need - self._hashes.keys())
+                self._hashes.update(zip(need, pool.map(image_hash, need,
+                                                       chunksize=16)))
+            paths = [path for path, _ in todo if not self._is_repeat(path)]
+            results = dict(zip(paths, pool.map(analyze_path, paths,
+                                                repeat(self.badge_dir))))
+        # in shooting order, so a repeat's predecessor is always known
+        for path, digest in todo:
+            if path in results:
+                result = results[path]
+                self.stats.record(result)
+            else:
+                pre = decode(path)
+                result = self._inherit(path, pre)
+                if result is None:
+                    result = analyze_path(path, self.badge_dir, pre)
+                    self.stats.record(result)
+            self._save(digest, result)
+            self._add(path, result)
+
+    def _hash(self, path: Path) -> int | None:
+        if path not in self._hashes:
+            self._hashes[path] = image_hash(path)
+        return self._hashes[path]
+
+    def _is_repeat(self, path: Path) -> bool:
+        prev = self.previous.get(path)
+        if prev is None or self.dup_distance <= 0:
+            return False
+        h, h_prev = self._hash(path), self._hash(prev)
+        if h is None or h_prev is None:
+            return False
+        return (h ^ h_prev).bit_count() <= self.dup_distance
+
+    def _inherit(self, path: Path, pre: Prefetched) -> Analysis | None:
+        prev = self.previous[path]
+        base = self.get(prev)
+        if base is None or pre.frame is None:
+            return None
+        badge = base.badge
+        if badge is not None:
+            badge = tuple(int(v / pre.scale) for v in badge)
+        face = face_vector(pre.frame.gray, badge)
+        if not same_face(face, base.face):
+            print(f'{path.name} looks like {prev.name} but shows another face')
+            return None
+        print(f'{path.name} repeats {prev.name}, reusing its analysis')
+        self.stats.repeats.append((path, prev))
+        return replace(base, face=face, inherited_from=prev)
+
+    def _add(self, path: Path, result: Analysis | None) -> Analysis | None:
+        if self.prefetcher is not None:
+            self.prefetcher.release(path)
+        if result is not None:
+            result.name, result.has_text = match_name(result.text,
+                                                      self.name_index)
+        self._entries[path] = result
+        if self.maxsize is not None and len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return result
+
+    def _stored(self, path: Path, digest: str) -> Analysis | None:
+        stored = self.store.get(digest)
+        if stored is None:
+            return None
+        self.stats.stored += 1
+        result = Analysis(*stored)
+        if self.badge_dir is not None and result.badge is not None:
+            save_badge_crop(path, result.badge, self.badge_dir)
+        return result
+
+    def _save(self, digest: str | None, result: Analysis | None):
+        if digest is not None and result is not None:
+            self.store.put(digest, result.size, result.badge, result.text,
+                           result.face)
 
 def save_jpeg(img: Image.Image, dest: Path):
     dest.parent.mkdir(parents=True, exist_ok=True)
     img.convert('RGB').save(dest, format='JPEG')
 
+EXIF_ORIENTATION = 0x0112
+WRITER_THREADS = 4
+
+def is_upright_jpeg(path: Path) -> bool:
+    """Return True if ``path`` is a JPEG that needs no rotation.
+
+    Only the file header is read, the pixels are not decoded.
+    """
+    try:
+        with Image.open(path) as img:
+            return (img.format == 'JPEG'
+                    and img.getexif().get(EXIF_ORIENTATION, 1) == 1)
+    except Exception:
+        return False
+
+def _write_output(src: Path, dest: Path, action: str):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if action == 'encode':
+        save_jpeg(load_image(src), dest)
+        return
+    if action == 'link':
+        dest.unlink(missing_ok=True)
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dest)
+
+class OutputWriter:
+    """Writes output images on a few background threads.
+
+    Upright JPEG sources are copied byte for byte (or hard linked with
+    ``link``) instead of being decoded and re-encoded; only HEIC, PNG and
+    rotated photos go through :func:`save_jpeg`.  With ``plan_only`` nothing
+    is written and the actions are only recorded in :attr:`manifest`.
+    """
+
+    def __init__(self, link: bool = False, plan_only: bool = False,
+                 threads: int = WRITER_THREADS):
+        self.link = link
+        self.plan_only = plan_only
+        self.manifest = []
+        self._pool = None if plan_only else ThreadPoolExecutor(threads)
+        self._pending = {}
+
+    def save(self, src: Path, dest: Path):
+        """Write ``src`` to ``dest`` as an upright JPEG."""
+        if not is_upright_jpeg(src):
+            action = 'encode'
+        else:
+            action = 'link' if self.link else 'copy'
+        self._submit(src, dest, action)
+
+    def copy(self, src: Path, dest: Path):
+        """Copy ``src`` to ``dest`` unchanged."""
+        self._submit(src, dest, 'copy')
+
+    def _submit(self, src: Path, dest: Path, action: str):
+        self.manifest.append({'source': str(src), 'dest': str(dest),
+                              'action': action})
+        if self._pool is None:
+            return
+        previous = self._pending.get(dest)
+        if previous is not None:
+            # a later write to the same name must still win
+            previous.result()
+        self._pending[dest] = self._pool.submit(_write_output, src, dest, action)
+
+    def flush(self):
+        """Wait for the writes submitted so far, raising the first error."""
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.result()
+
+    def close(self):
+        """Wait for all writes, raising the first error."""
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=True)
+        self.flush()
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description='Rename photos based on badge recognition')
@@ -137,6 +756,31 @@ def parse_args():
                         help='Spreadsheet has separate first and last name columns')
     parser.add_argument('--skip_rows', type=int, default=0,
                         help='Number of initial rows to skip when reading the spreadsheet')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Analyse all images up front on N processes')
+    parser.add_argument('--session_gap', type=float, default=SESSION_GAP,
+                        help='Seconds between photos that start a new session '
+                             '(0 to disable sessions)')
+    parser.add_argument('--dup_distance', type=int, default=DUP_DISTANCE,
+                        help='Max differing hash bits for a photo with the same '
+                             'face to reuse the previous photo\'s badge and '
+                             'text (0 to disable)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep watching the input folder and name photos '
+                             'as each session completes (stop with Ctrl+C)')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_FRAMES,
+                        help='Decode up to N upcoming photos in the background '
+                             '(0 to disable)')
+    parser.add_argument('--link', action='store_true',
+                        help='Hard link upright JPEGs into the output instead of copying')
+    parser.add_argument('--plan', default=None, metavar='FILE',
+                        help='Write the planned renames as JSON to FILE '
+                             '("-" for stdout) without writing any images')
+    parser.add_argument('--store', default=None,
+                        help='SQLite file of saved image analyses '
+                             '(default: next to the output folder)')
+    parser.add_argument('--no_store', action='store_true',
+                        help='Analyse every image from scratch and save nothing')
     return parser.parse_args()
 
 def read_names(path: Path, first_last: bool = False, skip_rows: int = 0):
@@ -160,118 +804,389 @@ def read_names(path: Path, first_last: bool = False, skip_rows: int = 0):
 def list_images(folder: Path):
     return sorted(p for p in folder.iterdir() if p.is_file())
 
-def find_matches(enc, start_index, images, names):
-    """Look ahead up to five images for matching faces."""
-    matches = []
-    for j in range(start_index + 1, min(len(images), start_index + 6)):
-        next_path = images[j]
-        try:
-            next_img = load_image(next_path)
-        except Exception:
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME = 0x0132
+# A pause longer than this many seconds between photos starts a new session.
+SESSION_GAP = 60
+# Larger sessions are not compared all-pairs but with the sliding window.
+SESSION_MAX_SIZE = 48
+
+def capture_time(path: Path) -> datetime | None:
+    """Return when ``path`` was taken according to EXIF, or ``None``.
+
+    Only the file header is read, the pixels are not decoded.
+    """
+    try:
+        if path.suffix.lower() in {'.heic', '.heif'}:
+            exif = Image.Exif()
+            exif.load(pillow_heif.open_heif(str(path)).info.get('exif') or b'')
+        else:
+            with Image.open(path) as img:
+                exif = img.getexif()
+        value = (exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL)
+                 or exif.get(EXIF_DATETIME))
+        return datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except Exception:
+        return None
+
+def find_sessions(images, gap: float = SESSION_GAP, known=None):
+    """Split ``images`` into sessions at pauses of more than ``gap`` seconds.
+
+    Returns a list of ``(start, end)`` index ranges, or ``None`` when some
+    image has no capture time, in which case only the sliding window bounds
+    the comparisons.  ``known`` is a dict of capture times by path that is
+    reused and filled in, so repeated calls read each header once.
+    """
+    if not images or gap <= 0:
+        return None
+    if known is None:
+        known = {}
+    for path in images:
+        if path not in known:
+            known[path] = capture_time(path)
+    times = [known[path] for path in images]
+    if any(t is None for t in times):
+        return None
+    sessions = []
+    start = 0
+    for i in range(1, len(times)):
+        delta = (times[i] - times[i - 1]).total_seconds()
+        if delta < 0 or delta > gap:
+            sessions.append((start, i))
+            start = i
+    sessions.append((start, len(times)))
+    return sessions
+
+def face_distances(vectors: np.ndarray) -> np.ndarray:
+    """Return the matrix of Euclidean distances between all pairs of rows."""
+    sq = np.einsum('ij,ij->i', vectors, vectors)
+    d2 = sq[:, None] + sq[None, :] - 2.0 * (vectors @ vectors.T)
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2)
+
+def face_components(faces, threshold: float = FACE_THRESHOLD,
+                    window: int | None = FACE_WINDOW) -> np.ndarray:
+    """Label connected groups of similar faces.
+
+    ``faces`` holds a face vector or ``None`` for each image in order.  Two
+    images are linked when both have a face, they are at most ``window``
+    positions apart (``None`` for no limit) and their distance is below
+    ``threshold``.  Each image is labelled with the position of the first
+    member of its group, or -1 if it has no face.
+    """
+    labels = np.full(len(faces), -1)
+    pos = np.array([i for i, f in enumerate(faces) if f is not None])
+    if pos.size == 0:
+        return labels
+    vectors = np.stack([faces[i] for i in pos]).astype(np.float64)
+    adjacent = face_distances(vectors) < threshold
+    if window is not None:
+        adjacent &= np.abs(pos[:, None] - pos[None, :]) <= window
+    component = np.full(pos.size, -1)
+    for start in range(pos.size):
+        if component[start] >= 0:
             continue
-        next_enc = face_vector(next_img)
-        if next_enc is None:
+        component[start] = start
+        frontier = np.array([start])
+        while frontier.size:
+            reached = adjacent[frontier].any(axis=0) & (component < 0)
+            component[reached] = start
+            frontier = np.flatnonzero(reached)
+    labels[pos] = pos[component]
+    return labels
+
+class FaceGroups:
+    """Groups of nearby images that show the same face.
+
+    Groups never cross a session boundary (see :func:`find_sessions`).  In a
+    session of at most ``SESSION_MAX_SIZE`` images every pair is compared.
+    Without ``sessions`` the whole folder is one range and only the sliding
+    window below applies.
+    Otherwise the group of an image is found on a slice of the session around
+    it: whenever a member sits within ``window`` of an end of the slice the
+    slice is widened and the components recomputed, so a long burst of one
+    person ends up in a single group no matter how many shots it has.
+    """
+
+    def __init__(self, images, cache: AnalysisCache, sessions=None,
+                 threshold: float = FACE_THRESHOLD, window: int = FACE_WINDOW):
+        self.images = images
+        self.cache = cache
+        self.threshold = threshold
+        self.window = window
+        # without capture times there are no known session boundaries, so
+        # never compare every pair of the folder
+        self.all_pairs = sessions is not None
+        self.sessions = sessions or [(0, len(images))]
+        self._session_starts = [start for start, _ in self.sessions]
+        self._groups = {}
+
+    def members(self, index: int) -> list[int]:
+        """Return the sorted indices of the group containing ``index``."""
+        if index in self._groups:
+            return self._groups[index]
+        start, end = self.sessions[bisect_right(self._session_starts, index) - 1]
+        if self.all_pairs and end - start <= SESSION_MAX_SIZE:
+            labels = face_components(self._faces(start, end, {}),
+                                     self.threshold, window=None)
+            for label in set(labels.tolist()) - {-1}:
+                members = [start + k for k in np.flatnonzero(labels == label)]
+                for k in members:
+                    self._groups[k] = members
+            return self._groups.get(index, [index])
+
+        lo = max(start, index - self.window)
+        hi = min(end, index + self.window + 1)
+        faces = {}
+        while True:
+            labels = face_components(self._faces(lo, hi, faces),
+                                     self.threshold, self.window)
+            label = labels[index - lo]
+            if label < 0:
+                return [index]
+            members = [lo + k for k in np.flatnonzero(labels == label)]
+            grown = False
+            if lo > start and members[0] - lo < self.window:
+                lo = max(start, lo - self.window)
+                grown = True
+            if hi < end and hi - 1 - members[-1] < self.window:
+                hi = min(end, hi + self.window)
+                grown = True
+            if not grown:
+                break
+        for k in members:
+            self._groups[k] = members
+        return members
+
+    def _faces(self, lo: int, hi: int, known: dict):
+        for k in range(lo, hi):
+            if k not in known:
+                info = self.cache.get(self.images[k])
+                known[k] = None if info is None else info.face
+        return [known[k] for k in range(lo, hi)]
+
+def find_matches(start_index, images, cache: AnalysisCache, groups: FaceGroups):
+    """Return later images in the same face group as ``start_index``."""
+    matches = []
+    for j in groups.members(start_index):
+        if j <= start_index:
             continue
-        distance = np.linalg.norm(enc - next_enc)
-        if distance < FACE_THRESHOLD:
-            next_name, _ = detect_name(next_img, names)
-            if next_name:
-                matches.append(('badge', next_path))
-            else:
-                matches.append(('photo', next_path))
+        next_path = images[j]
+        if cache.get(next_path).name:
+            matches.append(('badge', next_path))
+        else:
+            matches.append(('photo', next_path))
     return matches
 
-def save_badge(name: str, img: Image.Image, output_dir: Path, badge_counts: dict):
+def save_badge(name: str, img_path: Path, output_dir: Path, badge_counts: dict,
+               writer: OutputWriter):
     count = badge_counts.get(name, 0) + 1
     badge_counts[name] = count
     if count == 1:
         dest = output_dir / f'{name}-badge.jpeg'
     else:
         dest = output_dir / f'{name}-badge-{count}.jpeg'
-    save_jpeg(img, dest)
+    writer.save(img_path, dest)
     return count
 
-def copy_matches(name: str, matches, count: int, output_dir: Path, used: set):
+def copy_matches(name: str, matches, count: int, output_dir: Path, used: set,
+                 writer: OutputWriter):
     photo_num = 1
     for kind, path in matches:
         if kind == 'photo':
             dest = output_dir / f'{name}-{photo_num}.jpeg'
-            save_jpeg(load_image(path), dest)
+            writer.save(path, dest)
             used.add(path)
             photo_num += 1
         else:
             count += 1
             dest = output_dir / f'{name}-badge-{count}.jpeg'
-            save_jpeg(load_image(path), dest)
+            writer.save(path, dest)
             used.add(path)
     return count
 
-def process_badge(img_path: Path, img: Image.Image, name: str, index: int,
-                  images, names, output_dir, unmatched_dir, used, badge_counts,
-                  assigned_names):
-    # compute a simple face encoding from the badge image
-    enc = face_vector(img)
+def process_badge(img_path: Path, enc, name: str, index: int, images, cache,
+                  groups, output_dir, unmatched_dir, used, badge_counts,
+                  assigned_names, writer):
+    # the face encoding comes from the cached analysis of the badge image
     if enc is None:
         print(f'No face found in badge {img_path}')
-        shutil.copy(img_path, unmatched_dir / img_path.name)
+        writer.copy(img_path, unmatched_dir / img_path.name)
         used.add(img_path)
         return
     # look ahead for regular photos of the same person
-    matches = find_matches(enc, index, images, names)
-    count = save_badge(name, img, output_dir, badge_counts)
+    matches = find_matches(index, images, cache, groups)
+    count = save_badge(name, img_path, output_dir, badge_counts, writer)
     used.add(img_path)
-    count = copy_matches(name, matches, count, output_dir, used)
+    count = copy_matches(name, matches, count, output_dir, used, writer)
     badge_counts[name] = count
     assigned_names.add(name)
 
-def match_photo(img_path: Path, img: Image.Image, index: int, images, names,
-                output_dir, unmatched_dir, used, badge_counts):
-    # try to associate a non-badge photo with a nearby badge image
-    enc = face_vector(img)
+def match_photo(img_path: Path, enc, index: int, images, cache, groups,
+                output_dir, unmatched_dir, used, badge_counts, writer):
+    # try to associate a non-badge photo with a badge image of the same face
+    # group, preferring the closest one in shooting order
     matched = False
     if enc is not None:
-        # search both earlier and later images for a badge photo of the same person
-        for j in range(max(0, index - 5), min(len(images), index + 6)):
+        members = sorted(groups.members(index), key=lambda j: abs(j - index))
+        for j in members:
             if j == index:
                 continue
-            other_path = images[j]
-            try:
-                other_img = load_image(other_path)
-            except Exception:
-                continue
-            other_name, _ = detect_name(other_img, names)
-            if not other_name:
-                continue
-            other_enc = face_vector(other_img)
-            if other_enc is None:
+            other = cache.get(images[j])
+            if not other.name:
                 continue
-            distance = np.linalg.norm(other_enc - enc)
-            if distance < FACE_THRESHOLD:
-                count = badge_counts.get(other_name, 1)
-                dest = output_dir / f'{other_name}-{count}.jpeg'
-                save_jpeg(img, dest)
-                used.add(img_path)
-                matched = True
-                break
+            count = badge_counts.get(other.name, 1)
+            dest = output_dir / f'{other.name}-{count}.jpeg'
+            writer.save(img_path, dest)
+            used.add(img_path)
+            matched = True
+            break
     if not matched:
         print(f'Unmatched {img_path.name}')
-        shutil.copy(img_path, unmatched_dir / img_path.name)
+        writer.copy(img_path, unmatched_dir / img_path.name)
         used.add(img_path)
 
-def finalize_unmatched(images, used, unmatched_dir):
+def assign_images(indices, images, names, cache, groups, output_dir,
+                  unmatched_dir, used, badge_counts, assigned_names, writer):
+    """Name or set aside the images at ``indices`` in shooting order."""
+    for i in indices:
+        img_path = images[i]
+        if img_path in used:
+            continue
+        info = cache.get(img_path)
+        if info is None:
+            continue
+
+        name, has_text = info.name, info.has_text
+        print('Detected name', name)
+        print('has text', has_text)
+        if name:
+            process_badge(img_path, info.face, name, i, images, cache,
+                          groups, output_dir, unmatched_dir, used, badge_counts,
+                          assigned_names, writer)
+        elif has_text and len(set(names) - assigned_names) == 1:
+            remaining = list(set(names) - assigned_names)[0]
+            process_badge(img_path, info.face, remaining, i, images, cache,
+                          groups, output_dir, unmatched_dir, used, badge_counts,
+                          assigned_names, writer)
+        else:
+            match_photo(img_path, info.face, i, images, cache, groups,
+                        output_dir, unmatched_dir, used, badge_counts, writer)
+
+def finalize_unmatched(images, used, unmatched_dir, writer):
     """Copy any images we never processed to the unmatched directory."""
     for img_path in images:
         if img_path not in used:
             print(f'Unmatched {img_path.name}')
-            shutil.copy(img_path, unmatched_dir / img_path.name)
+            writer.copy(img_path, unmatched_dir / img_path.name)
+
+WATCH_POLL = 5.0
+
+def checkpoint_path(output_dir: Path) -> Path:
+    """Return where watch mode records its progress for ``output_dir``."""
+    output_dir = Path(output_dir).resolve()
+    return output_dir.parent / f'{output_dir.name}-watch.json'
+
+def load_checkpoint(path: Path):
+    """Return the finalized image names, badge counts and assigned names."""
+    if not path.exists():
+        return set(), {}, set()
+    data = json.loads(path.read_text())
+    return (set(data['finalized']), data['badge_counts'],
+            set(data['assigned_names']))
+
+def save_checkpoint(path: Path, finalized, badge_counts, assigned_names):
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps({
+        'finalized': sorted(finalized),
+        'badge_counts': badge_counts,
+        'assigned_names': sorted(assigned_names),
+    }, indent=2))
+    tmp.replace(path)
+
+def watch_images(input_dir: Path, names, cache, output_dir, unmatched_dir,
+                 writer, session_gap: float = SESSION_GAP,
+                 poll_interval: float = WATCH_POLL):
+    """Process photos as they are copied into ``input_dir`` until interrupted.
+
+    A file counts as arrived once its size stops changing between polls, and
+    is analysed straight away.  Photos are only named once their session has
+    closed: a later photo was taken more than ``session_gap`` seconds after
+    it, or nothing new has arrived for ``session_gap`` seconds.  Progress is
+    saved after every batch (see :func:`checkpoint_path`), so a restarted run
+    carries on where the last one stopped.
+    """
+    progress = checkpoint_path(output_dir)
+    finalized, badge_counts, assigned_names = load_checkpoint(progress)
+    if finalized:
+        print(f'Resuming: {len(finalized)} photos already done')
+    sizes = {}
+    arrived = set()
+    times = {}
+    last_arrival = time.monotonic()
+    try:
+        while True:
+            new = []
+            for path in list_images(input_dir):
+                try:
+                    size = path.stat().st_size
+                except FileNotFoundError:
+                    continue
+                if path not in arrived and size and sizes.get(path) == size:
+                    arrived.add(path)
+                    last_arrival = time.monotonic()
+                    if path.name not in finalized:
+                        new.append(path)
+                sizes[path] = size
+            images = sorted(arrived)
+            sessions = find_sessions(images, session_gap, times)
+            # before analysing, so new arrivals can be recognised as repeats
+            cache.previous = previous_frames(images, sessions)
+            for path in new:
+                cache.get(path)
+            if time.monotonic() - last_arrival >= session_gap:
+                closed = len(images)
+            elif sessions is not None:
+                closed = sessions[-1][0]
+            else:
+                closed = 0
+            pending = [i for i in range(closed)
+                       if images[i].name not in finalized]
+            if pending:
+                used = {path for path in images if path.name in finalized}
+                groups = FaceGroups(images, cache, sessions)
+                assign_images(pending, images, names, cache, groups,
+                              output_dir, unmatched_dir, used, badge_counts,
+                              assigned_names, writer)
+                finalize_unmatched([images[i] for i in pending], used,
+                                   unmatched_dir, writer)
+                writer.flush()
+                finalized.update(images[i].name for i in pending)
+                save_checkpoint(progress, finalized, badge_counts,
+                                assigned_names)
+                print(f'Finished {len(pending)} photos, '
+                      f'{len(finalized)} done so far')
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print('Stopping watch')
 
 def process_images(spreadsheet, input_dir, output_dir, unmatched_dir='unmatched',
-                   first_last=False, skip_rows=0, badge_dir=None):
+                   first_last=False, skip_rows=0, badge_dir=None,
+                   store_path=None, use_store=True, workers=1, link=False,
+                   plan_only=False, session_gap=SESSION_GAP,
+                   dup_distance=DUP_DISTANCE, watch=False,
+                   prefetch=PREFETCH_FRAMES):
     """Run the renaming process without using CLI arguments.
 
-    If ``badge_dir`` is provided, each detected badge crop is saved there using
-    the original filename with a ``-badgecrop.jpeg`` suffix.
+    Returns the output actions as dictionaries with ``source``, ``dest`` and
+    ``action`` keys.  With ``plan_only`` nothing is written: the store is only
+    read and no badge crops are saved.  ``watch`` follows the input folder
+    until interrupted and cannot be combined with ``plan_only`` or
+    ``workers``.  See the README for the other options.
     """
+    if watch and (plan_only or workers > 1):
+        raise ValueError('watch mode cannot be combined with a plan or workers')
     names = read_names(Path(spreadsheet), first_last=first_last,
                        skip_rows=skip_rows)
 
@@ -281,51 +1196,72 @@ def process_images(spreadsheet, input_dir, output_dir, unmatched_dir='unmatched'
     output_dir = Path(output_dir)
     unmatched_dir = Path(unmatched_dir)
 
-    output_dir.mkdir(parents=True, exist_ok=True)
-    unmatched_dir.mkdir(parents=True, exist_ok=True)
+    if not plan_only:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        unmatched_dir.mkdir(parents=True, exist_ok=True)
 
     images = list_images(input_dir)
     used = set()
     badge_counts = {}
     assigned_names = set()
+    if badge_dir and plan_only:
+        badge_dir = None
     if badge_dir:
         badge_dir = Path(badge_dir)
         badge_dir.mkdir(parents=True, exist_ok=True)
 
-    for i, img_path in enumerate(images):
-        if img_path in used:
-            continue
-        try:
-            print('loading image', img_path)
-            img = load_image(img_path)
-            print('loaded image', img_path)
-        except Exception as e:
-            print(f'Could not load {img_path}: {e}')
-            continue
-
-        name, has_text = detect_name(img, names, badge_dir, img_path)
-        print('Detected name', name)
-        print('has text', has_text)
-        if name:
-            process_badge(img_path, img, name, i, images, names,
-                          output_dir, unmatched_dir, used, badge_counts,
-                          assigned_names)
-        elif has_text and len(set(names) - assigned_names) == 1:
-            remaining = list(set(names) - assigned_names)[0]
-            process_badge(img_path, img, remaining, i, images, names,
-                          output_dir, unmatched_dir, used, badge_counts,
-                          assigned_names)
-        else:
-            match_photo(img_path, img, i, images, names, output_dir,
-                        unmatched_dir, used, badge_counts)
+    store = None
+    store_path = Path(store_path or default_store_path(output_dir))
+    if use_store and not (plan_only and not store_path.exists()):
+        store = AnalysisStore(store_path, DETECTOR_VERSION,
+                              readonly=plan_only)
+    writer = OutputWriter(link=link, plan_only=plan_only)
+    sessions = find_sessions(images, session_gap)
+    if sessions is not None:
+        print(f'{len(sessions)} sessions')
+    prefetcher = None
+    if prefetch > 0 and workers <= 1 and not watch:
+        prefetcher = Prefetcher(images, prefetch,
+                                store_path if store is not None else None,
+                                DETECTOR_VERSION)
+    cache = AnalysisCache(names, badge_dir, store=store,
+                          previous=previous_frames(images, sessions),
+                          dup_distance=dup_distance, prefetcher=prefetcher)
+    if watch:
+        watch_images(input_dir, names, cache, output_dir, unmatched_dir,
+                     writer, session_gap, WATCH_POLL)
+        writer.close()
+        cache.stats.report()
+        if store is not None:
+            store.close()
+        return writer.manifest
+    if workers > 1:
+        cache.precompute(images, workers)
+    groups = FaceGroups(images, cache, sessions)
 
-    finalize_unmatched(images, used, unmatched_dir)
+    assign_images(range(len(images)), images, names, cache, groups, output_dir,
+                  unmatched_dir, used, badge_counts, assigned_names, writer)
+    finalize_unmatched(images, used, unmatched_dir, writer)
+    if prefetcher is not None:
+        prefetcher.close()
+    writer.close()
+    cache.stats.report()
+    if store is not None:
+        store.close()
+    return writer.manifest
 
 
 def main():
-    print('Starting up')
     args = parse_args()
-    process_images(
+    plan_out = None
+    if args.plan == '-':
+        # keep stdout for the plan: everything else printed from here on,
+        # including by worker processes and tesseract, goes to stderr
+        sys.stdout.flush()
+        plan_out = os.fdopen(os.dup(1), 'w')
+        os.dup2(2, 1)
+    print('Starting up')
+    manifest = process_images(
         args.spreadsheet,
         args.input_dir,
         args.output_dir,
@@ -333,7 +1269,22 @@ def main():
         first_last=args.first_last,
         skip_rows=args.skip_rows,
         badge_dir=args.badge_dir,
+        store_path=args.store,
+        use_store=not args.no_store,
+        workers=args.workers,
+        link=args.link,
+        plan_only=args.plan is not None,
+        session_gap=args.session_gap,
+        dup_distance=args.dup_distance,
+        watch=args.watch,
+        prefetch=args.prefetch,
     )
+    if plan_out is not None:
+        sys.stdout.flush()
+        plan_out.write(json.dumps(manifest, indent=2) + '\n')
+        plan_out.close()
+    elif args.plan is not None:
+        Path(args.plan).write_text(json.dumps(manifest, indent=2))
 
 if __name__ == '__main__':
     main()
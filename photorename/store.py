@@ -0,0 +1,79 @@
+"""Persistent store of per-image analysis results for ``rename.py``.
+
+Results are keyed by a hash of the file contents together with the detector
+version, so renamed or moved files are still recognised and any change to the
+detectors invalidates old entries automatically.  Name matching is not stored:
+it is cheap and depends on the spreadsheet, so it is redone on every run.
+"""
+
+import hashlib
+import sqlite3
+from pathlib import Path
+import numpy as np
+
+
+def file_digest(path: Path) -> str:
+    """Return a hex digest of the contents of ``path``."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def default_store_path(output_dir: Path) -> Path:
+    """Return the store location used for ``output_dir`` (next to it)."""
+    output_dir = Path(output_dir).resolve()
+    return output_dir.parent / f'{output_dir.name}-analysis.sqlite'
+
+
+class AnalysisStore:
+    """SQLite table of badge rectangles, OCR text and face vectors."""
+
+    def __init__(self, path: Path, version: int, readonly: bool = False):
+        self.path = Path(path)
+        self.version = version
+        self.readonly = readonly
+        if readonly:
+            self.conn = sqlite3.connect(f'{self.path.resolve().as_uri()}?mode=ro',
+                                        uri=True, isolation_level=None)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), isolation_level=None)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS analysis ('
+            ' digest TEXT NOT NULL, version INTEGER NOT NULL,'
+            ' width INTEGER, height INTEGER,'
+            ' badge_x INTEGER, badge_y INTEGER, badge_w INTEGER, badge_h INTEGER,'
+            ' text TEXT, face BLOB, face_dtype TEXT,'
+            ' PRIMARY KEY (digest, version))')
+
+    def get(self, digest: str):
+        """Return ``(size, badge, text, face)`` for ``digest`` or ``None``."""
+        row = self.conn.execute(
+            'SELECT width, height, badge_x, badge_y, badge_w, badge_h,'
+            ' text, face, face_dtype FROM analysis'
+            ' WHERE digest = ? AND version = ?',
+            (digest, self.version)).fetchone()
+        if row is None:
+            return None
+        width, height, bx, by, bw, bh, text, face, face_dtype = row
+        badge = None if bx is None else (bx, by, bw, bh)
+        if face is not None:
+            face = np.frombuffer(face, dtype=face_dtype)
+        return (width, height), badge, text, face
+
+    def put(self, digest: str, size, badge, text: str, face):
+        """Record the analysis of the file with contents ``digest``."""
+        if self.readonly:
+            return
+        bx, by, bw, bh = badge if badge is not None else (None,) * 4
+        face_blob = None if face is None else face.tobytes()
+        face_dtype = None if face is None else face.dtype.str
+        self.conn.execute(
+            'INSERT OR REPLACE INTO analysis VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+            (digest, self.version, size[0], size[1], bx, by, bw, bh, text,
+             face_blob, face_dtype))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,53 @@
+"""Check that the parallel analysis stage gives the same result as the serial one.
+
+Run with ``python -m pytest photorename``.  Tesseract is not needed: OCR is
+replaced by a stand-in that derives a name from the pixels it is given.
+"""
+
+from functools import partial
+import multiprocessing
+from pathlib import Path
+import shutil
+import numpy as np
+import pytest
+
+import rename
+from workers import worker_pool
+
+SAMPLES = Path(__file__).resolve().parent.parent / 'photoformat' / 'sample_images'
+NAMES = ['Alice Smith', 'Bob Jones', 'Carol King']
+
+
+class FakeEngine:
+    def recognize(self, img) -> str:
+        level = int(np.asarray(img).mean())
+        return NAMES[level % 3] if level % 2 else ''
+
+    def recognize_batch(self, images) -> list[str]:
+        return [self.recognize(img) for img in images]
+
+
+def test_workers_match_serial(tmp_path, monkeypatch):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('needs forked workers to share the OCR stand-in')
+    monkeypatch.setattr(rename, 'get_engine', lambda psm=6: FakeEngine())
+    # forked workers inherit the stand-in; spawned ones (the default on macOS
+    # and from Python 3.14) would run the real Tesseract
+    monkeypatch.setattr(rename, 'worker_pool', partial(
+        worker_pool, mp_context=multiprocessing.get_context('fork')))
+    input_dir = tmp_path / 'in'
+    shutil.copytree(SAMPLES, input_dir)
+    first = sorted(input_dir.iterdir())[0]
+    # a byte-for-byte repeat right after its original
+    shutil.copyfile(first, first.with_name(first.stem + 'a' + first.suffix))
+    spreadsheet = tmp_path / 'names.csv'
+    spreadsheet.write_text('name\n' + '\n'.join(NAMES) + '\n')
+
+    def run(workers):
+        return rename.process_images(spreadsheet, input_dir, tmp_path / 'out',
+                                     tmp_path / 'unmatched', use_store=False,
+                                     plan_only=True, workers=workers)
+
+    serial = run(1)
+    assert len(serial) == len(list(input_dir.iterdir()))
+    assert run(2) == serial
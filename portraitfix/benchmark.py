@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Compare the full-resolution and fast background blur on sample photos."""
+
+import argparse
+from pathlib import Path
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+from process import blur_background, get_models, load_image
+
+SAMPLES = Path(__file__).resolve().parent.parent / 'photoformat' / 'sample_images'
+
+
+def measure(func, repeat: int):
+    """Return the result, mean seconds and peak MB of allocations of ``func``."""
+    func()  # warm up the model outside the measurement
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark background blur')
+    parser.add_argument('image_dir', nargs='?', default=str(SAMPLES),
+                        help='Folder of portraits (default: photoformat samples)')
+    parser.add_argument('--qualities', type=float, nargs='+', default=[1.0, 0.5, 0.25],
+                        help='Fast blur qualities to compare')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Enlarge the photos by this factor first')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per image and method')
+    args = parser.parse_args()
+
+    models = get_models()
+    methods = [('full', None)] + [(f'fast {q:g}', q) for q in args.qualities]
+    totals = {name: [0.0, 0.0] for name, _ in methods}
+    for path in sorted(Path(args.image_dir).iterdir()):
+        try:
+            img = load_image(path, bgr=True)
+        except OSError:
+            continue
+        if args.scale != 1.0:
+            img = cv2.resize(img, (0, 0), fx=args.scale, fy=args.scale)
+        line = [f'{path.name} {img.shape[1]}x{img.shape[0]}:']
+        reference = None
+        for name, quality in methods:
+            out, seconds, peak = measure(
+                lambda: blur_background(img, models=models, quality=quality), args.repeat)
+            totals[name][0] += seconds
+            totals[name][1] = max(totals[name][1], peak)
+            if reference is None:
+                reference = out
+                line.append(f'{name} {seconds * 1000:.0f} ms {peak:.0f} MB')
+            else:
+                diff = np.abs(out.astype(np.int16) - reference).mean()
+                line.append(f'{name} {seconds * 1000:.0f} ms {peak:.0f} MB (diff {diff:.1f})')
+        print(', '.join(line))
+    for name, (seconds, peak) in totals.items():
+        print(f'{name}: {seconds:.2f}s total, peak {peak:.0f} MB')
+
+
+if __name__ == '__main__':
+    main()
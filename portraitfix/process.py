@@ -2,34 +2,81 @@
 """Enhance portrait photos with optional color adjustment and background blur."""
 
 import argparse
+import csv
+from functools import partial
 from pathlib import Path
+import shutil
+import sys
 import cv2
 import numpy as np
-import mediapipe as mp
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'shared'))
+from imageload import load_image
+from mpmodels import Models, get_models
+from workers import worker_pool
 
-def is_washed_out(image: np.ndarray, threshold: float = 40.0) -> bool:
-    """Return True if the image appears low contrast."""
+
+# Long side of the frames the segmentation model sees in fast mode; the
+# landscape selfie model works at 256x144 internally anyway.
+SEGMENT_SIZE = 256
+BLUR_KERNEL = 25
+# Rows blended at once by the fast blur.
+BLEND_BAND = 256
+WASHED_OUT_THRESHOLD = 40.0
+BLURRED_THRESHOLD = 50.0
+# Long side of the thumbnail the auto modes screen photos on.
+SCREEN_SIZE = 512
+# Thumbnail metrics, then the full-size ones where the thumbnail was not
+# conclusive, then what was done.
+REPORT_FIELDS = ['file', 'contrast', 'background_sharpness', 'full_contrast',
+                 'full_background_sharpness', 'enhanced', 'blurred', 'copied']
+
+
+def fit_mask(mask: np.ndarray, image: np.ndarray) -> np.ndarray:
+    """Return ``mask`` scaled up to the size of ``image`` with soft edges."""
+    h, w = image.shape[:2]
+    if mask.shape[:2] == (h, w):
+        return mask
+    return cv2.resize(mask, (w, h), interpolation=cv2.INTER_LINEAR)
+
+
+def contrast(image: np.ndarray) -> float:
+    """Return the standard deviation of the gray levels of ``image``."""
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    return gray.std() < threshold
+    return float(gray.std())
 
 
-def background_is_blurred(
+def is_washed_out(image: np.ndarray, threshold: float = WASHED_OUT_THRESHOLD) -> bool:
+    """Return True if the image appears low contrast."""
+    return contrast(image) < threshold
+
+
+def background_sharpness(
     image: np.ndarray,
     mask: np.ndarray | None = None,
-    threshold: float = 50.0,
-) -> bool:
-    """Return True if the background has low sharpness."""
+    models: Models | None = None,
+) -> float | None:
+    """Return the Laplacian variance of the background, or ``None`` if the
+    person could not be segmented."""
     if mask is None:
-        with mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=1) as seg:
-            result = seg.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        mask = result.segmentation_mask
+        mask = (models or get_models()).segment(image)
     if mask is None:
-        return False
-    bg_mask = (mask <= 0.5).astype(np.uint8) * 255
+        return None
+    bg_mask = (fit_mask(mask, image) <= 0.5).astype(np.uint8) * 255
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     background = cv2.bitwise_and(gray, gray, mask=bg_mask)
-    return cv2.Laplacian(background, cv2.CV_64F).var() < threshold
+    return float(cv2.Laplacian(background, cv2.CV_64F).var())
+
+
+def background_is_blurred(
+    image: np.ndarray,
+    mask: np.ndarray | None = None,
+    threshold: float = BLURRED_THRESHOLD,
+    models: Models | None = None,
+) -> bool:
+    """Return True if the background has low sharpness."""
+    sharpness = background_sharpness(image, mask, models)
+    return sharpness is not None and sharpness < threshold
 
 
 def enhance_color(image: np.ndarray) -> np.ndarray:
@@ -42,19 +89,190 @@ def enhance_color(image: np.ndarray) -> np.ndarray:
     return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
 
 
-def blur_background(image: np.ndarray, mask: np.ndarray | None = None) -> np.ndarray:
-    """Blur background while keeping the person sharp using selfie segmentation."""
+def blur_background(
+    image: np.ndarray,
+    mask: np.ndarray | None = None,
+    models: Models | None = None,
+    quality: float | None = None,
+) -> np.ndarray:
+    """Blur background while keeping the person sharp using selfie segmentation.
+
+    Without ``quality`` the whole frame is blurred at full resolution and the
+    person is cut out with a hard edge.  With ``quality`` (0 to 1) the fast
+    path is used: segmentation runs at ``SEGMENT_SIZE``, the background is
+    blurred on a copy scaled by ``quality`` and scaled back up, and the
+    person is blended in through the soft, upscaled mask.  Lower values are
+    faster and slightly softer at the edges.
+    """
+    if quality is not None:
+        return _blur_background_fast(image, mask, models, quality)
     if mask is None:
-        with mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=1) as segmenter:
-            results = segmenter.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        mask = results.segmentation_mask
+        mask = (models or get_models()).segment(image)
     if mask is None:
         return image
-    mask_3 = cv2.cvtColor((mask > 0.5).astype(np.uint8) * 255, cv2.COLOR_GRAY2BGR)
-    blurred = cv2.GaussianBlur(image, (25, 25), 0)
+    mask_3 = cv2.cvtColor((fit_mask(mask, image) > 0.5).astype(np.uint8) * 255,
+                          cv2.COLOR_GRAY2BGR)
+    blurred = cv2.GaussianBlur(image, (BLUR_KERNEL, BLUR_KERNEL), 0)
     return np.where(mask_3 == 255, image, blurred)
 
 
+def _blur_background_fast(image, mask, models, quality: float) -> np.ndarray:
+    if mask is None:
+        mask = (models or get_models()).segment(image, SEGMENT_SIZE)
+    if mask is None:
+        return image
+    h, w = image.shape[:2]
+    quality = min(max(quality, 0.05), 1.0)
+    small = image
+    if quality < 1.0:
+        small = cv2.resize(image, (max(1, round(w * quality)), max(1, round(h * quality))),
+                           interpolation=cv2.INTER_AREA)
+    # the same blur radius relative to the frame, on fewer pixels
+    kernel = max(3, int(BLUR_KERNEL * quality) | 1)
+    blurred = cv2.GaussianBlur(small, (kernel, kernel), 0)
+    if quality < 1.0:
+        blurred = cv2.resize(blurred, (w, h), interpolation=cv2.INTER_LINEAR)
+    alpha = fit_mask(np.clip(mask * 255, 0, 255).astype(np.uint8), image)
+    # blend into the blurred frame a band at a time so the float weights
+    # never exist at full size
+    for top in range(0, h, BLEND_BAND):
+        rows = slice(top, top + BLEND_BAND)
+        weight = alpha[rows].astype(np.float32) * (1 / 255)
+        cv2.blendLinear(image[rows], blurred[rows], weight, 1.0 - weight,
+                        dst=blurred[rows])
+    return blurred
+
+
+def screen_image(path: Path, sharpness: bool = True,
+                 models: Models | None = None) -> dict:
+    """Return the auto-mode metrics of ``path`` measured on a thumbnail.
+
+    The JPEG is decoded straight to ``SCREEN_SIZE`` pixels.  On a smaller
+    copy the contrast is about the same and the background looks sharper,
+    so a photo that passes a check here would also pass it at full size.
+    The background sharpness needs segmentation and is only measured with
+    ``sharpness``.
+    """
+    thumb = load_image(path, SCREEN_SIZE, bgr=True)
+    metrics = {'contrast': contrast(thumb)}
+    if sharpness:
+        metrics['background_sharpness'] = background_sharpness(
+            thumb, (models or get_models()).segment(thumb, SEGMENT_SIZE))
+    return metrics
+
+
+def fix_image(
+    img: np.ndarray,
+    row: dict,
+    enhance: bool,
+    blur: bool,
+    auto_enhance: bool,
+    auto_blur: bool,
+    blur_quality: float | None = None,
+    models: Models | None = None,
+) -> np.ndarray:
+    """Return the decoded portrait ``img`` with the requested fixes applied.
+
+    The auto modes check the image itself; the measured metrics and what was
+    done are recorded in ``row`` (see :func:`skipped_fixes`).
+    """
+    models = models or get_models()
+    mask = None
+
+    if enhance:
+        img = enhance_color(img)
+        row['enhanced'] = True
+    elif auto_enhance:
+        row['full_contrast'] = contrast(img)
+        if row['full_contrast'] < WASHED_OUT_THRESHOLD:
+            img = enhance_color(img)
+            row['enhanced'] = True
+
+    if blur or auto_blur:
+        mask = models.segment(img, SEGMENT_SIZE if blur_quality is not None else None)
+
+    if blur:
+        img = blur_background(img, mask, models, blur_quality)
+        row['blurred'] = True
+    elif auto_blur:
+        sharpness = row['full_background_sharpness'] = background_sharpness(img, mask, models)
+        if sharpness is None or sharpness >= BLURRED_THRESHOLD:
+            img = blur_background(img, mask, models, blur_quality)
+            row['blurred'] = True
+    return img
+
+
+def skipped_fixes(row: dict) -> list[str]:
+    """Return notes on the auto fixes :func:`fix_image` found unnecessary."""
+    notes = []
+    if 'full_contrast' in row and not row.get('enhanced'):
+        notes.append('skipping enhance (not washed out)')
+    if 'full_background_sharpness' in row and not row.get('blurred'):
+        notes.append('skipping blur (already blurred)')
+    return notes
+
+
+def process_image(
+    path: Path,
+    output_dir: Path,
+    enhance: bool,
+    blur: bool,
+    auto_enhance: bool,
+    auto_blur: bool,
+    blur_quality: float | None = None,
+    screen: bool = True,
+) -> dict:
+    """Fix one portrait and save it under the same name in ``output_dir``.
+
+    ``blur_quality`` selects the fast blur; see :func:`blur_background`.  In
+    the auto modes (or with ``screen``) the photo is first checked on a
+    thumbnail (:func:`screen_image`); when it needs nothing the file is copied
+    byte for byte without being decoded or re-encoded.  Returns a row for the
+    ``--report`` CSV.
+    """
+    models = get_models()
+    row = {'file': path.name}
+    out_path = output_dir / path.name
+    if screen or auto_enhance or auto_blur:
+        try:
+            row.update(screen_image(path, auto_blur or screen, models))
+        except OSError:
+            print(f"Skipping {path}")
+            return row
+        if auto_enhance and not enhance and row['contrast'] >= WASHED_OUT_THRESHOLD:
+            print(f"{path.name}: skipping enhance (not washed out)")
+            auto_enhance = False
+        sharpness = row.get('background_sharpness')
+        if auto_blur and not blur and sharpness is not None and sharpness < BLURRED_THRESHOLD:
+            print(f"{path.name}: skipping blur (already blurred)")
+            auto_blur = False
+        if not (enhance or blur or auto_enhance or auto_blur):
+            shutil.copyfile(path, out_path)
+            row['copied'] = True
+            print(f"Copied {out_path}")
+            return row
+
+    try:
+        img = load_image(path, bgr=True)
+    except OSError:
+        print(f"Skipping {path}")
+        return row
+
+    img = fix_image(img, row, enhance, blur, auto_enhance, auto_blur, blur_quality, models)
+    for note in skipped_fixes(row):
+        print(f"{path.name}: {note}")
+
+    if not (row.get('enhanced') or row.get('blurred')):
+        # the full-size checks found nothing to do after all
+        shutil.copyfile(path, out_path)
+        row['copied'] = True
+        print(f"Copied {out_path}")
+        return row
+    cv2.imwrite(str(out_path), img)
+    print(f"Saved {out_path}")
+    return row
+
+
 def process_folder(
     input_dir: Path,
     output_dir: Path,
@@ -62,42 +280,38 @@ def process_folder(
     blur: bool,
     auto_enhance: bool,
     auto_blur: bool,
+    workers: int = 1,
+    blur_quality: float | None = None,
+    report: Path | None = None,
 ) -> None:
-    output_dir.mkdir(parents=True, exist_ok=True)
-    for path in input_dir.iterdir():
-        if path.suffix.lower() not in {'.jpg', '.jpeg', '.png'}:
-            continue
-        img = cv2.imread(str(path))
-        if img is None:
-            print(f"Skipping {path}")
-            continue
+    """Fix every portrait in ``input_dir``.
 
-        mask = None
-
-        if enhance:
-            img = enhance_color(img)
-        elif auto_enhance:
-            if is_washed_out(img):
-                img = enhance_color(img)
-            else:
-                print(f"{path.name}: skipping enhance (not washed out)")
-
-        if blur or auto_blur:
-            if mask is None:
-                with mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=1) as segmenter:
-                    mask = segmenter.process(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).segmentation_mask
-
-        if blur:
-            img = blur_background(img, mask)
-        elif auto_blur:
-            if not background_is_blurred(img, mask):
-                img = blur_background(img, mask)
-            else:
-                print(f"{path.name}: skipping blur (already blurred)")
-
-        out_path = output_dir / path.name
-        cv2.imwrite(str(out_path), img)
-        print(f"Saved {out_path}")
+    With ``workers`` above one the images are decoded, fixed and encoded on
+    that many processes, each with its own :class:`Models`.  With ``report``
+    the screening metrics and what was done to each photo are written there
+    as CSV.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = [path for path in sorted(input_dir.iterdir())
+             if path.suffix.lower() in {'.jpg', '.jpeg', '.png'}]
+    fix = partial(process_image, output_dir=output_dir, enhance=enhance,
+                  blur=blur, auto_enhance=auto_enhance, auto_blur=auto_blur,
+                  blur_quality=blur_quality, screen=report is not None)
+    if workers <= 1:
+        rows = [fix(path) for path in paths]
+    else:
+        with worker_pool(workers) as pool:
+            # chunks keep the per-task overhead small next to a fast model
+            rows = list(pool.map(fix, paths,
+                                 chunksize=max(1, len(paths) // (4 * workers))))
+    if report is not None:
+        with open(report, 'w', newline='') as f:
+            writer = csv.DictWriter(f, REPORT_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({'enhanced': False, 'blurred': False,
+                                 'copied': False, **row})
+        print(f"Wrote report to {report}")
 
 
 def parse_args():
@@ -108,6 +322,11 @@ def parse_args():
     p.add_argument('--blur', action='store_true', help='Blur background behind subject')
     p.add_argument('--auto-enhance', action='store_true', help='Enhance colors only if washed out')
     p.add_argument('--auto-blur', action='store_true', help='Blur background only if not already blurred')
+    p.add_argument('--workers', type=int, default=1, help='Number of processes to use')
+    p.add_argument('--blur-quality', type=float,
+                   help='Fast blur: blur the background at this fraction of full size '
+                        '(e.g. 0.25) and blend with a soft low-resolution mask')
+    p.add_argument('--report', help='Write the screening metrics of every photo to this CSV file')
     return p.parse_args()
 
 
@@ -122,4 +341,7 @@ if __name__ == '__main__':
         args.blur,
         args.auto_enhance,
         args.auto_blur,
+        args.workers,
+        args.blur_quality,
+        Path(args.report) if args.report else None,
     )
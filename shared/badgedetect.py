@@ -0,0 +1,205 @@
+"""Detection of white rectangular badges, shared by badgebot and photorename.
+
+Candidates are the outer contours of an Otsu threshold of a copy scaled to
+``DETECT_WIDTH``.  The mean brightness of a candidate's bounding box comes
+from a summed-area table in constant time, and candidates that could not beat
+the best score so far even as perfect rectangles are dropped before the
+contour area is measured.
+
+Lines of text inside a badge (or a whole frame) are found as runs of
+character-sized MSER regions and cut out as small binarised strips of a fixed
+glyph height, which is all OCR needs to see.
+"""
+
+from collections import namedtuple
+import cv2
+import numpy as np
+
+DETECT_WIDTH = 1000
+# Candidates covering less than this fraction of the frame are ignored.
+MIN_AREA = 0.005
+MIN_ASPECT = 0.4
+MAX_ASPECT = 2.5
+
+
+def find_badge(image: np.ndarray):
+    """Return bounding box (x, y, w, h) of the most likely badge or ``None``.
+
+    ``image`` is a BGR or grayscale array; only the gray levels are used.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    # Resize large images for faster processing while keeping a scale factor
+    scale = DETECT_WIDTH / image.shape[1]
+    if scale < 1.0:
+        gray = cv2.resize(image, (0, 0), fx=scale, fy=scale)
+        factor = 1.0 / scale
+    else:
+        gray = image
+        factor = 1.0
+
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    # Automatically choose a threshold value with Otsu's method
+    _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    img_area = gray.shape[0] * gray.shape[1]
+    # 32-bit sums are faster and enough unless the frame is very tall
+    depth = cv2.CV_32S if img_area * 255 < 2 ** 31 else cv2.CV_64F
+    sums = cv2.integral(gray, sdepth=depth)
+
+    best_rect = None
+    best_score = 0.0
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        rect_area = float(w * h)
+        # the contour never covers more than its bounding box
+        if rect_area < img_area * MIN_AREA:
+            continue
+        if not (MIN_ASPECT <= w / float(h) <= MAX_ASPECT):
+            continue
+
+        total = (int(sums[y + h, x + w]) - int(sums[y, x + w])
+                 - int(sums[y + h, x]) + int(sums[y, x]))
+        whiteness = total / (rect_area * 255.0)
+        # the score grows with the contour area, so a contour filling its
+        # bounding box is the best this candidate can do
+        if whiteness ** 3 / (rect_area / img_area) ** 0.5 <= best_score:
+            continue
+
+        area = cv2.contourArea(cnt)
+        if area < img_area * MIN_AREA:
+            continue
+        rectangularity = area / rect_area
+        score = (whiteness ** 3) * (rectangularity ** 2) / ((area / img_area) ** 0.5)
+
+        if score > best_score:
+            best_score = score
+            best_rect = (
+                int(x * factor),
+                int(y * factor),
+                int(w * factor),
+                int(h * factor),
+            )
+    return best_rect
+
+
+def crop_badge(image: np.ndarray):
+    """Return the badge region of ``image`` (a view) or ``None``."""
+    rect = find_badge(image)
+    if rect is None:
+        return None
+    x, y, w, h = rect
+    return image[y : y + h, x : x + w]
+
+
+TEXT_WIDTH = 1000
+# Runs of more character-like regions than this are too cluttered to group.
+MAX_CHARACTERS = 2000
+# Text lines are scaled so their characters are this many pixels tall, with
+# a white margin around them.
+GLYPH_HEIGHT = 32
+STRIP_MARGIN = 8
+# Lines taller than this many character heights are chains drifting across
+# rows or around a picture rather than text.
+MAX_LINE_SPREAD = 2.0
+
+# ``chars`` is the number of characters and ``glyph`` their median height.
+TextLine = namedtuple('TextLine', 'x y w h chars glyph')
+
+
+def character_boxes(gray: np.ndarray, max_height: float = 0.2) -> np.ndarray:
+    """Return boxes (x, y, w, h) of character-sized MSER regions in ``gray``.
+
+    Detection runs on a copy at most ``TEXT_WIDTH`` wide; the boxes are in
+    the coordinates of ``gray``.  Regions taller than ``max_height`` of the
+    image are ignored.
+    """
+    scale = TEXT_WIDTH / gray.shape[1]
+    small = gray
+    if scale < 1.0:
+        small = cv2.resize(gray, (TEXT_WIDTH, max(1, round(gray.shape[0] * scale))),
+                           interpolation=cv2.INTER_LINEAR)
+    else:
+        scale = 1.0
+    _, boxes = cv2.MSER_create().detectRegions(small)
+    if len(boxes) == 0:
+        return np.empty((0, 4))
+    boxes = np.asarray(boxes, dtype=np.float64)
+    _, _, w, h = boxes.T
+    keep = (h >= 5) & (h <= small.shape[0] * max_height) & (w <= 2.0 * h) & (w >= 0.1 * h)
+    # MSER reports the same blob at several thresholds; keep one box each
+    _, first = np.unique(np.round(boxes[keep] / 4.0), axis=0, return_index=True)
+    return boxes[keep][np.sort(first)] / scale
+
+
+def text_lines(boxes: np.ndarray):
+    """Group character ``boxes`` into lines of text.
+
+    Two characters belong to the same line when they have similar heights,
+    sit at the same level and are at most two character heights apart.
+    Returns a :class:`TextLine` for every line of two or more characters,
+    top to bottom, or ``None`` if there are too many boxes to group cheaply.
+    """
+    if len(boxes) > MAX_CHARACTERS:
+        return None
+    if len(boxes) < 2:
+        return []
+    x, y, w, h = boxes.T
+    cy = y + h / 2
+    ratio = h[:, None] / h[None, :]
+    same_line = (np.abs(cy[:, None] - cy[None, :]) < 0.5 * h[:, None]) & \
+        (ratio > 0.67) & (ratio < 1.5)
+    gap = np.maximum(x[None, :] - (x + w)[:, None], x[:, None] - (x + w)[None, :])
+    neighbours = same_line & (gap < 2.0 * h[:, None]) & (gap > -0.15 * h[:, None])
+    neighbours |= neighbours.T
+    np.fill_diagonal(neighbours, False)
+
+    label = np.full(len(boxes), -1)
+    lines = []
+    for start in np.flatnonzero(neighbours.any(axis=1)):
+        if label[start] >= 0:
+            continue
+        label[start] = start
+        members = [start]
+        frontier = [start]
+        while frontier:
+            new = np.flatnonzero(neighbours[frontier.pop()] & (label < 0))
+            label[new] = start
+            members.extend(new)
+            frontier.extend(new)
+        x0, y0 = x[members].min(), y[members].min()
+        x1, y1 = (x + w)[members].max(), (y + h)[members].max()
+        lines.append(TextLine(int(x0), int(y0), int(np.ceil(x1 - x0)),
+                              int(np.ceil(y1 - y0)), len(members),
+                              float(np.median(h[members]))))
+    lines.sort(key=lambda line: (line[1], line[0]))
+    return lines
+
+
+def text_strips(gray: np.ndarray, lines) -> list[np.ndarray]:
+    """Cut each :class:`TextLine` out of ``gray`` as black text on white,
+    scaled so its characters are ``GLYPH_HEIGHT`` tall.  Lines spread over more than ``MAX_LINE_SPREAD``
+    character heights are skipped."""
+    strips = []
+    for x, y, w, h, _, glyph in lines:
+        if h > MAX_LINE_SPREAD * glyph:
+            continue
+        pad = max(1, h // 4)
+        crop = gray[max(0, y - pad):y + h + pad, max(0, x - pad):x + w + pad]
+        # by the character height: a line box also spans ascenders,
+        # descenders and slight slant
+        scale = GLYPH_HEIGHT / glyph
+        crop = cv2.resize(crop, (max(1, round(crop.shape[1] * scale)),
+                                 max(1, round(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+        _, binary = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # text covers less of the strip than the background does
+        if cv2.countNonZero(binary) < binary.size / 2:
+            binary = 255 - binary
+        strips.append(cv2.copyMakeBorder(binary, STRIP_MARGIN, STRIP_MARGIN,
+                                         STRIP_MARGIN, STRIP_MARGIN,
+                                         cv2.BORDER_CONSTANT, value=255))
+    return strips
@@ -0,0 +1,103 @@
+"""Image loading shared by the photo tools.
+
+Every tool reads photos through :func:`load_image` so JPEG, PNG and HEIF files
+are handled the same way and EXIF orientation is applied exactly once.
+
+Detection only needs about ``DETECT_SIZE`` pixels, so callers can pass a
+``max_size``.  JPEGs are then decoded directly at 1/2, 1/4 or 1/8 scale by the
+JPEG library (DCT scaling) and HEIF files use an embedded thumbnail when one is
+large enough; only the final writes decode at full resolution.
+
+The tools are plain scripts, so they import this module after adding this
+folder to ``sys.path``::
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'shared'))
+"""
+
+from pathlib import Path
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+import pillow_heif
+
+pillow_heif.register_heif_opener()
+
+JPEG_SUFFIXES = {'.jpg', '.jpeg'}
+HEIF_SUFFIXES = {'.heic', '.heif'}
+IMAGE_SUFFIXES = JPEG_SUFFIXES | HEIF_SUFFIXES | {'.png'}
+DETECT_SIZE = 1000
+
+_REDUCED_FLAGS = [(8, cv2.IMREAD_REDUCED_COLOR_8),
+                  (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+
+def load_scaled(path: Path, max_size: int | None = None, bgr: bool = False):
+    """Return ``(image, scale)`` for the photo at ``path``.
+
+    The image is upright and its longer side is at most ``max_size`` pixels
+    (full resolution if ``max_size`` is ``None``).  ``scale`` is the full
+    resolution size divided by the returned size, so coordinates found in the
+    image are mapped back by multiplying with it.  The image is a PIL image,
+    or a BGR NumPy array when ``bgr`` is set.  Raises ``OSError`` if the file
+    cannot be read.
+    """
+    path = Path(path)
+    if bgr and path.suffix.lower() not in HEIF_SUFFIXES:
+        return _load_bgr(path, max_size)
+    if bgr and max_size is None:
+        # libheif decodes straight into BGR order
+        try:
+            heif = pillow_heif.open_heif(str(path), bgr_mode=True)
+            return np.asarray(heif), 1.0
+        except ValueError as e:
+            # libheif reports corrupt and truncated files as ValueError
+            raise OSError(f'cannot read {path}') from e
+    img, scale = _load_pil(path, max_size)
+    if not bgr:
+        return img, scale
+    return cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR), scale
+
+
+def load_image(path: Path, max_size: int | None = None, bgr: bool = False):
+    """Return the upright photo at ``path``; see :func:`load_scaled`."""
+    return load_scaled(path, max_size, bgr)[0]
+
+
+def _fit(size, max_size: int):
+    scale = max_size / max(size)
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+
+def _load_pil(path: Path, max_size: int | None):
+    img = Image.open(path)
+    full = max(img.size)
+    if max_size is not None and full > max_size:
+        # picks the smallest DCT scale (JPEG) or thumbnail (HEIF) that still
+        # covers the requested size; a no-op for other formats
+        img.draft(None, _fit(img.size, max_size))
+    ImageOps.exif_transpose(img, in_place=True)
+    if max_size is not None and max(img.size) > max_size:
+        img = img.resize(_fit(img.size, max_size), Image.BILINEAR)
+    return img, full / max(img.size)
+
+
+def _load_bgr(path: Path, max_size: int | None):
+    flag = cv2.IMREAD_COLOR
+    full = None
+    if max_size is not None and path.suffix.lower() in JPEG_SUFFIXES:
+        with Image.open(path) as header:
+            full = max(header.size)
+        for factor, reduced in _REDUCED_FLAGS:
+            if full / factor >= max_size:
+                flag = reduced
+                break
+    img = cv2.imread(str(path), flag)
+    if img is None:
+        raise OSError(f'cannot read {path}')
+    h, w = img.shape[:2]
+    full = full or max(h, w)
+    if max_size is not None and max(h, w) > max_size:
+        img = cv2.resize(img, _fit((w, h), max_size),
+                         interpolation=cv2.INTER_AREA)
+    return img, full / max(img.shape[:2])
@@ -0,0 +1,71 @@
+"""MediaPipe models kept loaded between images.
+
+Building a MediaPipe graph takes longer than running it on a portrait, so each
+process creates the models it needs once, on first use, and every tool passes
+the same :class:`Models` to all of its stages.
+"""
+
+import os
+import cv2
+import numpy as np
+import mediapipe as mp
+
+
+class Models:
+    """Lazily created MediaPipe face detection, pose and selfie segmentation."""
+
+    def __init__(self):
+        self._face_detection = None
+        self._pose = None
+        self._segmenter = None
+
+    @property
+    def face_detection(self):
+        if self._face_detection is None:
+            self._face_detection = mp.solutions.face_detection.FaceDetection(
+                model_selection=1, min_detection_confidence=0.5)
+        return self._face_detection
+
+    @property
+    def pose(self):
+        if self._pose is None:
+            self._pose = mp.solutions.pose.Pose(static_image_mode=True)
+        return self._pose
+
+    @property
+    def segmenter(self):
+        if self._segmenter is None:
+            self._segmenter = mp.solutions.selfie_segmentation.SelfieSegmentation(model_selection=1)
+        return self._segmenter
+
+    def segment(self, image: np.ndarray, max_size: int | None = None) -> np.ndarray | None:
+        """Return the person probability mask of a BGR image.
+
+        With ``max_size`` the image is scaled down first and the mask has
+        the reduced size.
+        """
+        h, w = image.shape[:2]
+        if max_size is not None and max(h, w) > max_size:
+            scale = max_size / max(h, w)
+            image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                               interpolation=cv2.INTER_AREA)
+        return self.segmenter.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).segmentation_mask
+
+    def close(self):
+        for name in ('_face_detection', '_pose', '_segmenter'):
+            model = getattr(self, name)
+            if model is not None:
+                model.close()
+                setattr(self, name, None)
+
+
+_models = {}
+
+
+def get_models() -> Models:
+    """Return this process's :class:`Models`, creating them on first use."""
+    # keyed by pid, see workers.py
+    models = _models.get(os.getpid())
+    if models is None:
+        models = _models[os.getpid()] = Models()
+    return models
@@ -0,0 +1,25 @@
+"""Process pools shared by the photo tools.
+
+Models that are slow to load (Tesseract, MediaPipe graphs) are kept in
+module-level dicts keyed by ``os.getpid()``.  A forked worker inherits those
+dicts, so the key makes it build its own instance instead of using the
+parent's, whose native state must not be shared between processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+
+
+def _init_worker():
+    # each worker is one core; keep OpenCV from spawning its own thread pool
+    cv2.setNumThreads(1)
+
+
+def worker_pool(workers: int | None = None, mp_context=None) -> ProcessPoolExecutor:
+    """Return a process pool of ``workers`` single-threaded OpenCV workers.
+
+    ``mp_context`` picks how workers are started, as for
+    :class:`ProcessPoolExecutor`; by default the platform's start method.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                               initializer=_init_worker)